@@ -0,0 +1,165 @@
+""" Timings for replaying decompiled figures
+
+Run this script like
+python benchmark.py
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+from decompiler import Decompiler
+import bytecode
+import spec
+
+
+def best_time(func, repeat=5):
+    """Shortest wall time of several calls to func, in seconds"""
+    result = None
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        plt.close('all')
+        if result is None or elapsed < result:
+            result = elapsed
+    return result
+
+
+def line_figure(num_lines, num_points=100):
+    """A figure with many lines, each with its own data and style"""
+    fig = plt.figure()
+    ax = fig.add_subplot(111)
+    x = np.arange(num_points)
+    for i in range(num_lines):
+        ax.plot(x, np.sin(x * (i + 1) / 10.), color='rgb'[i % 3],
+                lw=1 + i % 2, label='line %i' % i)
+    return fig
+
+
+def spec_vs_script(sizes=((10, 100), (100, 100), (1000, 100),
+                          (10, 100000), (100, 10000))):
+    """Compare executing rendered scripts with loading figure specs
+
+    :param sizes: Sequence of (number of lines, points per line)
+    """
+    tmp = tempfile.mkdtemp()
+    try:
+        print ('lines  points  statements  exec(render()) (s)  '
+               'spec.load (s)  speedup')
+        for num, points in sizes:
+            fig = line_figure(num, points)
+            d = Decompiler()
+            d.ingest(fig, name_hint='fig')
+            plt.close(fig)
+            source = d.render()
+            path = os.path.join(tmp, 'fig.npz')
+            d.save_spec(path)
+
+            def run_script():
+                exec(compile(source, '<script>', 'exec'), {})
+
+            script = best_time(run_script)
+            loaded = best_time(lambda: spec.load(path))
+            print '%5i  %6i  %10i  %18.4f  %13.4f  %6.1fx' % (
+                num, points, source.count('\n') + 1, script, loaded,
+                script / loaded)
+    finally:
+        shutil.rmtree(tmp)
+
+
+def concurrent_decompiles(threads=(1, 2, 4, 8), per_thread=10,
+                          num_lines=50):
+    """Throughput of decompiling and rendering figures in many threads"""
+    from matplotlib.figure import Figure
+    fig = Figure()
+    ax = fig.add_subplot(111)
+    x = np.arange(100)
+    for i in range(num_lines):
+        ax.plot(x, np.sin(x * (i + 1) / 10.), color='rgb'[i % 3])
+
+    def work():
+        for _ in range(per_thread):
+            d = Decompiler()
+            d.ingest(fig, name_hint='fig')
+            d.render()
+
+    print 'threads  decompiles  time (s)  decompiles / s'
+    for num in threads:
+        pool = [threading.Thread(target=work) for _ in range(num)]
+        start = time.time()
+        for t in pool:
+            t.start()
+        for t in pool:
+            t.join()
+        elapsed = time.time() - start
+        total = num * per_thread
+        print '%7i  %10i  %8.3f  %14.1f' % (num, total, elapsed,
+                                            total / elapsed)
+
+
+FIRST_DRAW = """
+import time
+start = time.time()
+import runpy
+import matplotlib
+matplotlib.use('Agg')
+fig = runpy.run_path(%r)['fig']
+replayed = time.time()
+fig.canvas.draw()
+print replayed - start, time.time() - start
+"""
+
+
+def first_draw(path):
+    """Seconds from starting a script in a new interpreter until it
+    finishes, and until the figure it defines as fig is drawn"""
+    out = subprocess.check_output([sys.executable, '-W', 'ignore', '-c',
+                                   FIRST_DRAW % path])
+    return tuple(float(x) for x in out.split()[-2:])
+
+
+def precompiled_replay(sizes=(450, 1400, 4500), repeat=3):
+    """Compare scripts and precompiled stubs, by the time to replay the
+    script and the time to first draw
+
+    :param sizes: Number of lines in each figure. Each line takes about
+    22 statements
+    """
+    tmp = tempfile.mkdtemp()
+    try:
+        print ('statements  replay: source  precompiled  '
+               'first draw: source  precompiled')
+        for num in sizes:
+            fig = line_figure(num)
+            d = Decompiler()
+            d.ingest(fig, name_hint='fig')
+            plt.close(fig)
+            path = os.path.join(tmp, 'fig%i.py' % num)
+            source = d.render(path, precompile=True)
+            _, stub = bytecode.paths(path)
+
+            script = [first_draw(path) for _ in range(repeat)]
+            compiled = [first_draw(stub) for _ in range(repeat)]
+            print '%10i  %14.3f  %11.3f  %18.3f  %11.3f' % (
+                source.count('\n') + 1,
+                min(t[0] for t in script), min(t[0] for t in compiled),
+                min(t[1] for t in script), min(t[1] for t in compiled))
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == "__main__":
+    spec_vs_script()
+    print
+    concurrent_decompiles()
+    print
+    precompiled_replay()
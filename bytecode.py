@@ -0,0 +1,78 @@
+""" Write rendered scripts along with their compiled code, so that
+replaying a large script doesn't have to parse and compile it first
+
+For a script figure.py, write() adds:
+
+ * figure.pyc: the compiled script, in the format Python 2 uses for
+   its own bytecode caches (magic number, source mtime, marshalled code)
+ * figure_run.py: a stub that runs figure.pyc, or falls back to
+   figure.py if the compiled code was written by another version of
+   Python, or if figure.py changed since
+
+The stub doesn't need this package, and leaves the objects the script
+defines in its own namespace.
+"""
+import marshal
+import os
+import struct
+
+import imp
+
+STUB = '''""" Runs %(source)s from its compiled code in %(compiled)s, if that
+was compiled by this version of Python from the current source """
+import marshal
+import os
+import struct
+
+try:
+    from importlib.util import MAGIC_NUMBER as _magic
+except ImportError:
+    from imp import get_magic
+    _magic = get_magic()
+
+_dir = os.path.dirname(os.path.abspath(__file__))
+_source = os.path.join(_dir, %(source)r)
+_code = None
+try:
+    with open(os.path.join(_dir, %(compiled)r), 'rb') as _f:
+        _header = _f.read(8)
+        _mtime = int(os.stat(_source).st_mtime) & 0xFFFFFFFF
+        if _header == _magic + struct.pack('<I', _mtime):
+            _code = marshal.load(_f)
+except (IOError, OSError, EOFError, ValueError, TypeError):
+    pass
+if _code is None:
+    with open(_source) as _f:
+        _code = compile(_f.read(), _source, 'exec')
+exec(_code, globals())
+'''
+
+
+def paths(path):
+    """The compiled code and stub file names for a script file name"""
+    base = os.path.splitext(path)[0]
+    return base + '.pyc', base + '_run.py'
+
+
+def write(source, path):
+    """Write a script, its compiled code, and a stub that runs it
+
+    :param source: The script
+    :param path: The file name to write the script to
+
+    :rtype: tuple of (compiled code file name, stub file name)
+    """
+    compiled, stub = paths(path)
+    with open(path, 'w') as f:
+        f.write(source)
+    code = compile(source, path, 'exec')
+    mtime = int(os.stat(path).st_mtime) & 0xFFFFFFFF
+    with open(compiled, 'wb') as f:
+        f.write(imp.get_magic())
+        f.write(struct.pack('<I', mtime))
+        marshal.dump(code, f)
+
+    with open(stub, 'w') as f:
+        f.write(STUB % dict(source=os.path.basename(path),
+                            compiled=os.path.basename(compiled)))
+    return compiled, stub
@@ -1,56 +1,261 @@
+from collections import Mapping, defaultdict
+import threading
 import types
 
-from expression import Expression, ExpressionManager
+from expression import (Expression, ExpressionManager, LiteralExpression,
+                        ReferenceExpression)
+import bytecode
+import snapshot
+import spec
+
+try:
+    import filters
+except ImportError:
+    filters = None
+
+
+def ndarray_source(x):
+    """Python source for a numpy array"""
+    return 'np.loads(%r)' % x.dumps()
+
+
+def numpy_scalar_source(x):
+    """Python source for a numpy scalar, as the equivalent python number"""
+    return repr(x.item())
+
+
+class FactoryRegistry(Mapping):
+    """An immutable mapping from types to expression factories
+
+    with_factory returns an updated copy instead, so that threads can
+    read a registry while factories are registered
+    """
+    def __init__(self, factories=()):
+        self._factories = dict(factories)
+
+    def __getitem__(self, typ):
+        return self._factories[typ]
+
+    def __iter__(self):
+        return iter(self._factories)
+
+    def __len__(self):
+        return len(self._factories)
+
+    def with_factory(self, typ, factory):
+        """A copy of this registry, with a factory for objects of type typ"""
+        result = FactoryRegistry()
+        result._factories = dict(self._factories)
+        result._factories[typ] = factory
+        return result
+
+
+_register_lock = threading.Lock()
 
 
 class Decompiler(object):
     """Builds expressions from objects, determines order of execution,
-    use ExpressionManager to build script"""
+    use ExpressionManager to build script
+
+    Decompilers can run in many threads at once, but each instance
+    should only be used by one thread at a time. Instances use the
+    factories that were registered when they were created
+    """
 
     expression_factory = {}
 
-    def __init__(self, manager = None):
+    #types of objects that ingest filters apply to. Other objects are
+    #decompiled whenever something depends on them
+    filtered_types = ()
+
+    def __init__(self, manager = None, include=None, exclude=None,
+                 max_depth=None, reference_only=False):
+        """
+        :param manager: Optional ExpressionManager to add expressions to
+        :param include: Optional predicate. Artists below the ingested
+        object are left out, unless they (or an artist they contain)
+        match it. See the filters module
+        :param exclude: Optional predicate. Artists that match it are
+        left out
+        :param max_depth: Optional maximum number of artists between the
+        ingested object and the artists that are decompiled (so 1
+        decompiles a figure and its axes, but no lines)
+        :param reference_only: If True, the script refers to objects
+        that were left out by variable name (see references()).
+        Otherwise, statements that need them are left out as well
+        """
         self.mgr = manager or ExpressionManager()
+        self.include = include
+        self.exclude = exclude
+        self.max_depth = max_depth
+        self.reference_only = reference_only
+        self._factories = self.expression_factory
         self._processed = {}
+        self._available = set()
+        self._roots = set()
+        self._depth = None
         self._imports = []
 
+    @classmethod
+    def register(cls, typ, factory):
+        """Use factory(decompiler, obj) to decompile objects of type typ,
+        in this class and its subclasses"""
+        with _register_lock:
+            cls.expression_factory = \
+                cls.expression_factory.with_factory(typ, factory)
+
     def ingest(self, obj, name_hint=None):
-        """ Recursively decompile an object into Expression objects """
+        """ Recursively decompile an object into Expression objects
+
+        :rtype: bool. Whether obj is defined or referenced by the
+        expressions, which it isn't if it (or an object its definition
+        needs) is filtered out
+        """
         oid = id(obj)
         if oid in self._processed:
-            return
+            return oid in self._available
+
+        parent = self._depth
+        depth = parent or 0
+        if parent is not None and isinstance(obj, self.filtered_types):
+            depth += 1
+            if not self._wanted(obj, depth):
+                return self._leave_out(obj, name_hint)
 
         typ = type(obj)
         try:
             func = obj.__expfac__
         except AttributeError:
             try:
-                func = self.expression_factory[typ]
+                func = self._factories[typ]
             except KeyError:
                 raise TypeError("Don't know how to decompile objects "
                                 "of type %s" % typ)
 
-        exps = func(self, obj)
-        if exps[0].output_ref is not obj:
-            raise TypeError("First expression returned from expression factory"
-                            " must define %r as output ref" % obj)
-        if name_hint:
-            exps[0].out_name_hint = name_hint
+        self._depth = depth
+        try:
+            exps = func(self, obj)
+            if exps[0].output_ref is not obj:
+                raise TypeError("First expression returned from expression "
+                                "factory must define %r as output ref" % obj)
+            if name_hint:
+                exps[0].out_name_hint = name_hint
+
+            deps = [d for e in exps for d in e.dependencies]
+            self._processed[oid] = obj
+            self._available.add(oid)
 
-        deps = [d for e in exps for d in e.dependencies]
-        self._processed[oid] = obj
+            for d in deps:
+                self.ingest(d)
+        finally:
+            self._depth = parent
 
-        for d in deps:
-            self.ingest(d)
+        if parent is None:
+            self._roots.add(oid)
+        if not self._complete(exps[0]):
+            self._withdraw(obj, exps)
+            return self._leave_out(obj, name_hint)
+        self.mgr.extend(e for e in exps if self._complete(e))
+        return True
 
-        self.mgr.extend(exps)
+    def _wanted(self, obj, depth):
+        """Whether an object passes the ingest filters"""
+        if self.max_depth is not None and depth > self.max_depth:
+            return False
+        if self.exclude is not None and self.exclude(obj):
+            return False
+        return self.include is None or filters.selects(self.include, obj)
+
+    def _complete(self, expression):
+        """Whether all the dependencies of an expression are available"""
+        return all(id(d) in self._available
+                   for d in expression.dependencies)
+
+    def _withdraw(self, obj, exps):
+        """Undo ingesting an object whose definition turned out to need
+        an object that was left out
+
+        Objects ingested along with obj were added as if it was
+        available. Unless obj will be referenced, removes the
+        expressions that need it. Also removes definitions that only
+        the removed expressions, or obj's own expressions, needed
+        """
+        users = defaultdict(list)
+        for e in self.mgr.expressions:
+            for d in e.dependencies:
+                users[id(d)].append(e)
+        removed = set()
+        unused = dict((id(d), d) for e in exps for d in e.dependencies)
+
+        def drop(e):
+            removed.add(id(e))
+            self.mgr.remove(e)
+            for d in e.dependencies:
+                unused[id(d)] = d
+
+        lost = [] if self.reference_only else [obj]
+        while lost:
+            o = lost.pop()
+            self._available.discard(id(o))
+            for e in users.pop(id(o), ()):
+                if id(e) not in removed:
+                    drop(e)
+                    if hasattr(e, 'output_ref'):
+                        lost.append(e.output_ref)
+
+        while unused:
+            oid, o = unused.popitem()
+            e = self.mgr.definer(o)
+            if e is None or id(e) in removed or oid in self._roots or \
+                    any(id(u) not in removed for u in users.get(oid, ())):
+                continue
+            #ingest it again if something else needs it later
+            self._available.discard(oid)
+            del self._processed[oid]
+            drop(e)
+
+    def _leave_out(self, obj, name_hint):
+        """Leave an object out of the decompile, or refer to it by name"""
+        self._processed[id(obj)] = obj
+        if not self.reference_only:
+            return False
+        hint = name_hint or type(obj).__name__.lower()
+        self.mgr.append(ReferenceExpression(obj, out_name_hint=hint))
+        self._available.add(id(obj))
+        return True
+
+    def references(self):
+        """Objects that the script refers to without defining them
+
+        :rtype: dict mapping variable names to objects. Running the
+        script with these defined replays it against the original objects
+        """
+        return dict((self.mgr.label(e.output_ref), e.output_ref)
+                    for e in self.mgr.expressions
+                    if isinstance(e, ReferenceExpression))
 
     def add_import(self, stmt):
         if stmt not in self._imports:
             self._imports.append(stmt)
 
-    def render(self):
-        """Render all decompiled objects into python statements"""
+    def render(self, path=None, precompile=False):
+        """Render all decompiled objects into python statements
+
+        :param path: Optional file name to write the script to
+        :param precompile: If True, also write the compiled script and a
+        stub that runs it next to path (see bytecode.write)
+        """
+        if precompile and path is None:
+            raise ValueError("Precompiling requires a path")
+        source = self._render()
+        if precompile:
+            bytecode.write(source, path)
+        elif path is not None:
+            with open(path, 'w') as f:
+                f.write(source)
+        return source
+
+    def _render(self):
         result = []
         result.extend(self._imports)
         for exp in self.mgr.ordered_expressions():
@@ -66,9 +271,28 @@ class Decompiler(object):
 
         return '\n'.join(result)
 
+    def save(self, path):
+        """Save decompiled expressions and imports to a snapshot file"""
+        snapshot.save(self.mgr, path, self._imports)
+
+    def save_spec(self, path):
+        """Save decompiled expressions to a figure spec file, which
+        spec.load() rebuilds faster than the rendered script runs"""
+        spec.save(self.mgr, path, self._imports)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Create a Decompiler from a snapshot file written by save()
+
+        The result can render, but not ingest the original objects
+        """
+        mgr, imports = snapshot.load(path, mmap=mmap)
+        result = cls(mgr)
+        result._imports = imports
+        return result
+
     def _literal_factory(self, x):
-        e = Expression("%r" % x, output_ref=x, inlined=True)
-        return [e]
+        return [LiteralExpression(x)]
 
     expression_factory[types.IntType] = _literal_factory
     expression_factory[types.LongType] = _literal_factory
@@ -116,14 +340,35 @@ class Decompiler(object):
 
     def _ndarray_factory(self, x):
         self.add_import('import numpy as np')
-        s = x.dumps()
-        template = 'np.loads({{s}})'
-        return [Expression(template, s=s, output_ref=x)]
+        return [LiteralExpression(x, encoder=ndarray_source, inlined=False)]
+
+    def _numpy_scalar_factory(self, x):
+        return [LiteralExpression(x, encoder=numpy_scalar_source)]
+
+    def _masked_array_factory(self, x):
+        # .data and .mask are views on the original buffers, so the
+        # payload reaches the ndarray factory with dtype and layout intact
+        self.add_import('import numpy as np')
+        data = x.data
+        self.ingest(data, name_hint='data')
+        if not x.mask.any():
+            return [Expression('np.ma.masked_array({{data}})',
+                               data=data, output_ref=x,
+                               out_name_hint='masked')]
+        mask = x.mask
+        self.ingest(mask, name_hint='mask')
+        return [Expression('np.ma.masked_array({{data}}, mask={{mask}})',
+                           data=data, mask=mask, output_ref=x,
+                           out_name_hint='masked')]
 
     try:
         import numpy as np
         expression_factory[np.ndarray] = _ndarray_factory
-        expression_factory[np.float64] = _literal_factory
+        expression_factory[np.ma.MaskedArray] = _masked_array_factory
+        for kind in ('int', 'uint', 'float', 'complex'):
+            for scalar in np.sctypes[kind]:
+                expression_factory[scalar] = _numpy_scalar_factory
+        expression_factory[np.bool_] = _numpy_scalar_factory
     except ImportError:
         pass
 
@@ -134,12 +379,23 @@ class Decompiler(object):
         from matplotlib.collections import PathCollection
         from matplotlib.axes import Axes, _subplot_classes
         from matplotlib.figure import Figure
+        from matplotlib.image import AxesImage
+        from matplotlib.collections import QuadMesh, PolyCollection
+        from matplotlib.colors import (LinearSegmentedColormap,
+                                       ListedColormap)
+        from matplotlib.artist import Artist
         import mpl_factories as mplf
+        filtered_types = (Artist,)
         expression_factory[Line2D] = mplf.mpl_plot_fac
         expression_factory[PathCollection] = mplf.mpl_scatter_fac
         expression_factory[Axes] = mplf.mpl_axes_fac
         expression_factory[Figure] = mplf.mpl_figure_fac
         expression_factory[plt.Rectangle] = mplf.mpl_rect_fac
+        expression_factory[AxesImage] = mplf.mpl_image_fac
+        expression_factory[QuadMesh] = mplf.mpl_quadmesh_fac
+        expression_factory[PolyCollection] = mplf.mpl_poly_fac
+        expression_factory[LinearSegmentedColormap] = mplf.mpl_cmap_fac
+        expression_factory[ListedColormap] = mplf.mpl_cmap_fac
         expression_factory[cbook.silent_list] = _list_factory
 
         ### subclasses can be defined after this statement
@@ -147,3 +403,5 @@ class Decompiler(object):
             expression_factory[subplt] = mplf.mpl_subplot_fac
     except ImportError:
         pass
+
+Decompiler.expression_factory = FactoryRegistry(Decompiler.expression_factory)
@@ -1,22 +1,47 @@
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from itertools import count
 
+import keyword
 import re
+import threading
 from jinja2 import Template
 
 from util import toposort
 
 TAG_RE = re.compile('\{\{\s*?(?P<tag>[a-zA-Z]\w*)\s*?\}\}')
 
-def disambiguate(label, taken):
+# compiled templates, shared by all threads. Lookups don't lock; the
+# cache is emptied when it fills up
+TEMPLATE_CACHE_SIZE = 4096
+_templates = {}
+_templates_lock = threading.Lock()
+
+def compiled_template(template):
+    """A jinja Template for a template string, compiled once per process"""
+    try:
+        return _templates[template]
+    except KeyError:
+        pass
+    result = Template(template)
+    with _templates_lock:
+        if len(_templates) >= TEMPLATE_CACHE_SIZE:
+            _templates.clear()
+        return _templates.setdefault(template, result)
+
+def disambiguate(label, taken, start=1):
+    """label, or label with the first numeric suffix from start that
+    isn't taken
+
+    :rtype: tuple of (label, suffix number, or None if unsuffixed)
+    """
     if label not in taken:
-        return label
+        return label, None
     suffix = "_%2.2i"
     label = str(label)
-    for i in count(1):
+    for i in count(start):
         candidate = label + (suffix % i)
         if candidate not in taken:
-            return candidate
+            return candidate, i
 
 class Expression(object):
     """Representation of a python expression with variable dependencies
@@ -49,7 +74,7 @@ class Expression(object):
 
         :rtype: String: a valid python statement of the expression
         """
-        t = Template(self.template)
+        t = compiled_template(self.template)
         tags = TAG_RE.findall(self.template)
         kwargs = dict((tag, oracle.reference(self.refs[tag])) for tag in tags)
         result = str(t.render(**kwargs))
@@ -67,11 +92,13 @@ class Expression(object):
 
         tags = TAG_RE.findall(self.template)
         result = []
+        seen = set()
         for t in tags:
-            if t in result:
+            if t in seen:
                 continue
             if t not in self.refs:
                 raise RuntimeError("Missing dependency for %s" % t)
+            seen.add(t)
             result.append(self.refs[t])
         return result
 
@@ -84,6 +111,69 @@ class Expression(object):
         return False
 
 
+class LiteralExpression(Expression):
+    """An Expression that defines an object from its value alone,
+    like "5" or "np.loads('...')"
+
+    Code is generated from the value by calling encoder when rendered,
+    so large values are not converted to source during ingestion
+    """
+    def __init__(self, value, encoder=repr, inlined=True,
+                 out_name_hint=None):
+        super(LiteralExpression, self).__init__(inlined=inlined,
+                                                out_name_hint=out_name_hint,
+                                                output_ref=value)
+        self.encoder = encoder
+
+    def render(self, oracle):
+        return self.encoder(self.output_ref)
+
+    @property
+    def dependencies(self):
+        return []
+
+
+class PropertyExpression(Expression):
+    """An Expression that sets a single property on an object,
+    like "{{artist}}.set_color( {{val}} )"
+
+    Optimization passes use the prop attribute to reason about which
+    state a statement writes
+    """
+    def __init__(self, artist, prop, val):
+        super(PropertyExpression, self).__init__(
+            "{{artist}}.set_%s( {{val}} )" % prop, artist=artist, val=val)
+        self.prop = prop
+
+    @property
+    def artist(self):
+        return self.refs['artist']
+
+    @property
+    def value(self):
+        return self.refs['val']
+
+
+class ReferenceExpression(Expression):
+    """An Expression that refers to an object by its variable name,
+    without defining it
+
+    The variable has to be defined before the script runs. Decompilers
+    use these for objects that are left out of a decompile
+    """
+    def __init__(self, obj, out_name_hint=None):
+        super(ReferenceExpression, self).__init__(inlined=True,
+                                                  out_name_hint=out_name_hint,
+                                                  output_ref=obj)
+
+    def render(self, oracle):
+        return oracle.label(self.output_ref)
+
+    @property
+    def dependencies(self):
+        return []
+
+
 class ExpressionGroup(object):
     """Collection of expressions that should be executed together, in order"""
     #XXX This is not well supported currently. Maybe remove?
@@ -105,33 +195,57 @@ class ExpressionGroup(object):
 
 class ExpressionManager(object):
     def __init__(self, exps=None):
-        self._exps = []
+        self._exps = OrderedDict()
         self._refs = {}
         self._ref_labels = {}
+        self._taken_labels = set()
+        #for each name hint, the first suffix that might be free. Cleared
+        #when a label is released, so that labels stay the lowest free ones
+        self._next_suffix = {}
+        self._aliases = defaultdict(dict)
         if exps is not None:
             self.extend(exps)
 
     def ordered_expressions(self):
-        return toposort(self.dependency_graph())
+        """Expressions in execution order. Independent expressions keep
+        the order they were added in"""
+        index = dict((id(e), i) for i, e in enumerate(self._exps.values()))
+        return toposort(self.dependency_graph(), key=lambda e: index[id(e)])
 
     def dependency_graph(self):
-        result = {e : set() for e in self._exps}
-        num = len(self._exps)
-        for i in range(num):
-            if not hasattr(self._exps[i], 'output_ref'):
-                continue
-            outr = self._exps[i].output_ref
-            for j in range(num):
-                if any(outr is d for d in self._exps[j].dependencies):
-                    result[self._exps[j]].add(self._exps[i])
+        result = {e : set() for e in self._exps.values()}
+        for e in self._exps.values():
+            for d in e.dependencies:
+                definer = self._refs.get(id(d))
+                if definer is not None:
+                    result[e].add(definer)
         return result
 
+    def definer(self, obj):
+        """The expression that defines an object, or None"""
+        return self._refs.get(id(obj))
+
+    def label(self, obj):
+        """The variable name assigned to an object"""
+        return self._ref_labels[id(obj)]
+
     def _register_reference_label(self, obj, hint=''):
         hint = hint or 'object'
+        if keyword.iskeyword(hint):
+            hint += '_'
         oid = id(obj)
         assert oid not in self._ref_labels
-        name = disambiguate(hint, set(self._ref_labels.values()))
+        start = self._next_suffix.get(hint, 1)
+        name, i = disambiguate(hint, self._taken_labels, start)
+        if i is not None:
+            self._next_suffix[hint] = i + 1
         self._ref_labels[oid] = name
+        self._taken_labels.add(name)
+
+    def _unregister(self, oid):
+        del self._refs[oid]
+        self._taken_labels.discard(self._ref_labels.pop(oid))
+        self._next_suffix.clear()
 
     def reference(self, obj):
         """A variable name for an object, or definition if inlined """
@@ -161,11 +275,16 @@ class ExpressionManager(object):
         for e in expressions:
             self.append(e)
 
-    def append(self, expression):
-        if expression in self._exps:
+    def append(self, expression, label=None):
+        """Add an expression to the manager
+
+        :param label: Optional variable name for the expression's output.
+        Defaults to a name derived from expression.out_name_hint
+        """
+        if id(expression) in self._exps:
             return
 
-        self._exps.append(expression)
+        self._exps[id(expression)] = expression
         if not hasattr(expression, 'output_ref'):
             return
 
@@ -175,4 +294,41 @@ class ExpressionManager(object):
             raise RuntimeError("Conflicting expressions to define %r" % out)
 
         self._refs[oid] = expression
-        self._register_reference_label(out, hint=expression.out_name_hint)
+        self._register_reference_label(out,
+                                       hint=label or expression.out_name_hint)
+
+    def alias(self, obj, expression, label=None):
+        """Register an object defined as a side effect of an expression,
+        like the objects created inside a loop
+
+        :param label: Optional variable name for the object. Defaults to a
+        name derived from expression.out_name_hint
+        """
+        oid = id(obj)
+        if oid in self._refs:
+            raise RuntimeError("Conflicting expressions to define %r" % obj)
+
+        self._refs[oid] = expression
+        self._aliases[id(expression)][oid] = obj
+        self._register_reference_label(obj,
+                                       hint=label or expression.out_name_hint)
+
+    def aliases(self):
+        """List of (object, expression) pairs registered with alias()"""
+        return [(obj, self._refs[oid]) for objs in self._aliases.values()
+                for oid, obj in objs.items()]
+
+    def remove(self, expression):
+        """Drop an expression, and the reference labels of the objects
+        it defines"""
+        del self._exps[id(expression)]
+        for oid in self._aliases.pop(id(expression), {}):
+            self._unregister(oid)
+
+        if not hasattr(expression, 'output_ref'):
+            return
+        self._unregister(id(expression.output_ref))
+
+    @property
+    def expressions(self):
+        return list(self._exps.values())
@@ -0,0 +1,50 @@
+""" Predicates for the include and exclude options of Decompiler
+
+Each function returns a predicate that takes a matplotlib artist. Combine
+them with lambdas, like
+
+    include=lambda a: on_axes(ax)(a) and not labeled('_*')(a)
+"""
+from fnmatch import fnmatchcase
+
+from matplotlib.axes import Axes
+from matplotlib.figure import Figure
+
+
+def of_type(*types):
+    """Matches artists that are instances of any of the types"""
+    return lambda artist: isinstance(artist, types)
+
+
+def labeled(*patterns):
+    """Matches artists whose label matches any of the shell-style
+    patterns, like "temp*" """
+    def result(artist):
+        label = artist.get_label()
+        if label is None:
+            return False
+        return any(fnmatchcase(label, p) for p in patterns)
+    return result
+
+
+def on_axes(*axes):
+    """Matches the axes, and the artists drawn in them"""
+    def result(artist):
+        return any(artist is ax or getattr(artist, 'axes', None) is ax
+                   for ax in axes)
+    return result
+
+
+def children(artist):
+    """The artists a Decompiler reaches from a figure or axes"""
+    if isinstance(artist, Figure):
+        return list(artist.axes)
+    if isinstance(artist, Axes):
+        return artist.lines + artist.images + artist.collections
+    return []
+
+
+def selects(predicate, artist):
+    """Whether a predicate matches an artist, or any artist it contains"""
+    return predicate(artist) or any(selects(predicate, c)
+                                    for c in children(artist))
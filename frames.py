@@ -0,0 +1,187 @@
+""" Decompile a sequence of figure states into one animation script
+
+The first frame is decompiled in full. Later frames only contribute the
+properties that changed since the frame before, which are replayed by a
+FuncAnimation update function.
+"""
+import hashlib
+
+import numpy as np
+from matplotlib.lines import Line2D
+from matplotlib.collections import PathCollection, QuadMesh, PolyCollection
+from matplotlib.image import AxesImage
+from matplotlib.axes import Axes
+from matplotlib.figure import Figure
+
+from decompiler import Decompiler
+from expression import Expression
+from properties import (plot_properties, scatter_properties,
+                        axes_properties, figure_properties,
+                        image_properties, mesh_properties, poly_properties)
+
+
+def _fingerprint(value):
+    """A cheaply comparable summary of a property value.
+
+    Arrays are summarized by their type, dtype, shape and a hash of their
+    contents, so that old frames don't have to be kept around
+    """
+    if isinstance(value, np.ndarray):
+        result = (type(value), value.dtype.str, value.shape)
+        if value.dtype.hasobject:
+            return result + tuple(_fingerprint(v) for v in value.flat)
+        data = np.ascontiguousarray(value)
+        result += (hashlib.sha1(data.data).hexdigest(),)
+        if isinstance(value, np.ma.MaskedArray):
+            mask = np.ascontiguousarray(np.ma.getmaskarray(value))
+            result += (hashlib.sha1(mask.data).hexdigest(),)
+        return result
+    if isinstance(value, (list, tuple)):
+        return (type(value),) + tuple(_fingerprint(v) for v in value)
+    return value
+
+
+def _artists(fig):
+    """The artists of a figure whose state is tracked, in a stable order"""
+    yield fig
+    for ax in fig.axes:
+        yield ax
+        for a in ax.lines + ax.images + ax.collections:
+            yield a
+
+
+class FrameDecompiler(Decompiler):
+    """Decompiles a sequence of figure states into an animation
+
+    Frames can be different figures with the same layout, or the same
+    figure, modified between calls to add_frame. Artists are matched
+    across frames by their position in the figure. As with Decompiler,
+    arrays must not be modified in place after they are added; replace
+    them instead (as set_data does)
+    """
+
+    #properties compared across frames, for each artist type
+    state_properties = {
+        Figure: figure_properties,
+        Axes: axes_properties,
+        Line2D: ('xdata', 'ydata') + plot_properties,
+        PathCollection: ('offsets', 'array') + scatter_properties,
+        AxesImage: ('array',) + image_properties,
+        QuadMesh: ('array',) + mesh_properties,
+        PolyCollection: ('array',) + poly_properties,
+    }
+
+    def __init__(self, manager=None, interval=200):
+        super(FrameDecompiler, self).__init__(manager)
+        self.interval = interval
+        self._artists = None
+        self._initial = None
+        self._state = None
+        self._frames = []
+        self._finished = False
+
+    def _properties(self, artist):
+        for cls in type(artist).__mro__:
+            if cls in self.state_properties:
+                return self.state_properties[cls]
+        return ()
+
+    def _read_state(self, fig):
+        """Current values and fingerprints of all tracked properties"""
+        artists = list(_artists(fig))
+        if self._artists is not None:
+            if [type(a) for a in artists] != \
+                    [type(a) for a in self._artists]:
+                raise ValueError("Frame %i does not have the same artists "
+                                 "as the first frame" % len(self._frames))
+
+        values = {}
+        for i, artist in enumerate(artists):
+            for prop in self._properties(artist):
+                values[i, prop] = getattr(artist, 'get_%s' % prop)()
+        fingerprints = dict((k, _fingerprint(v)) for k, v in values.items())
+        return artists, values, fingerprints
+
+    def add_frame(self, fig):
+        """Add the current state of a figure as the next frame"""
+        if self._finished:
+            raise RuntimeError("Cannot add frames after rendering")
+
+        artists, values, fingerprints = self._read_state(fig)
+        if self._artists is None:
+            self.ingest(fig)
+            self._artists = artists
+            self._initial = values, fingerprints
+            self._state = fingerprints
+            self._frames.append([])
+            return
+
+        changes = [k for k in sorted(fingerprints)
+                   if fingerprints[k] != self._state[k]]
+        for k in changes:
+            self.ingest(values[k])
+        self._frames.append([(k, values[k]) for k in changes])
+        self._state = fingerprints
+
+    def ingest_frames(self, figs):
+        """Add each figure state in a sequence as a frame"""
+        for fig in figs:
+            self.add_frame(fig)
+
+    def _frame_expression(self, updates):
+        template = ', '.join("({{a_%3.3i}}.set_%s, {{v_%3.3i}})" % (i, prop, i)
+                             for i, ((_, prop), _) in enumerate(updates))
+        kwargs = {}
+        for i, ((artist, _), value) in enumerate(updates):
+            kwargs['a_%3.3i' % i] = self._artists[artist]
+            kwargs['v_%3.3i' % i] = value
+        return Expression('[%s]' % template, output_ref=[],
+                          inlined=not updates, out_name_hint='frame',
+                          **kwargs)
+
+    def _finish(self):
+        """Add the expressions that replay each frame"""
+        self._finished = True
+        if len(self._frames) < 2:
+            return
+
+        #the first frame undoes changes made by the last, so the
+        #animation can repeat
+        values, fingerprints = self._initial
+        restore = [(k, values[k]) for k in sorted(fingerprints)
+                   if fingerprints[k] != self._state[k]]
+        for _, v in restore:
+            self.ingest(v)
+        self._frames[0] = restore
+
+        frames = [self._frame_expression(f) for f in self._frames]
+        template = ', '.join('{{f_%3.3i}}' % i for i in range(len(frames)))
+        kwargs = dict(('f_%3.3i' % i, f.output_ref)
+                      for i, f in enumerate(frames))
+        frame_list = Expression('[%s]' % template, output_ref=[],
+                                out_name_hint='frames', **kwargs)
+        update = Expression("lambda i: [setter(value) for setter, value "
+                            "in {{frames}}[i]]", frames=frame_list.output_ref,
+                            output_ref=object(), out_name_hint='update')
+        anim = Expression("FuncAnimation({{fig}}, {{update}}, "
+                          "frames=len({{frames}}), interval={{interval}})",
+                          fig=self._artists[0], update=update.output_ref,
+                          frames=frame_list.output_ref,
+                          interval=self.interval,
+                          output_ref=object(), out_name_hint='anim')
+
+        self.add_import('from matplotlib.animation import FuncAnimation')
+        self.ingest(self.interval)
+        self.mgr.extend(frames + [frame_list, update, anim])
+
+    def render(self, path=None, precompile=False):
+        if precompile and path is None:
+            raise ValueError("Precompiling requires a path")
+        if not self._finished:
+            self._finish()
+        return super(FrameDecompiler, self).render(path, precompile)
+
+    def save_spec(self, path):
+        if not self._finished:
+            self._finish()
+        super(FrameDecompiler, self).save_spec(path)
@@ -1,14 +1,16 @@
 from properties import (plot_properties, scatter_properties,
-                        axes_properties, figure_properties, rect_properties)
+                        axes_properties, figure_properties, rect_properties,
+                        image_properties, mesh_properties, poly_properties)
 
-from expression import Expression
+from matplotlib.path import Path
+
+from expression import Expression, PropertyExpression
 
 def _set_properties(artist, properties):
     result = []
     for prop in properties:
         val = getattr(artist, 'get_%s' % prop)()
-        result.append(Expression("{{artist}}.set_%s( {{val}} )" % prop,
-                                 artist=artist, val=val))
+        result.append(PropertyExpression(artist, prop, val))
     return result
 
 def mpl_plot_fac(decomp, artist):
@@ -26,13 +28,11 @@ def mpl_plot_fac(decomp, artist):
     return exps
 
 def mpl_scatter_fac(decomp, artist):
-    decomp.add_import('import matplotlib.pyplot as plt')
-
     xy = artist.get_offsets()
     result = []
 
-    result.append(Expression("plt.scatter({{xy}}[:, 0], {{xy}}[:, 1])",
-                             xy=xy, output_ref=artist,
+    result.append(Expression("{{ax}}.scatter({{xy}}[:, 0], {{xy}}[:, 1])",
+                             xy=xy, output_ref=artist, ax=artist.axes,
                              out_name_hint="scatter"))
     result.extend(_set_properties(artist, scatter_properties))
     return result
@@ -51,6 +51,9 @@ def mpl_axes_fac(decomp, ax):
     result.append(Expression("{{ax}}.lines = {{lines}}",
                              ax=ax,
                              lines=ax.lines))
+    result.append(Expression("{{ax}}.collections = {{collections}}",
+                             ax=ax,
+                             collections=ax.collections))
     return result
 
 def mpl_subplot_fac(decomp, ax):
@@ -78,3 +81,71 @@ def mpl_rect_fac(decomp, rect):
                          out_name_hint='rect')]
     result.extend(_set_properties(rect, rect_properties))
     return result
+
+def mpl_cmap_fac(decomp, cmap):
+    decomp.add_import('import matplotlib.pyplot as plt')
+    return [Expression("plt.get_cmap({{name}})", name=cmap.name,
+                       output_ref=cmap, inlined=True)]
+
+def _set_array(artist):
+    """Pass the color array of a ScalarMappable through untouched, so
+    that the ndarray factories see the original buffer"""
+    a = artist.get_array()
+    if a is None:
+        return []
+    return [Expression("{{artist}}.set_array( {{a}} )",
+                       artist=artist, a=a)]
+
+def mpl_image_fac(decomp, im):
+    decomp.add_import('from matplotlib.image import AxesImage')
+
+    data = im.get_array()
+    result = [Expression("AxesImage({{ax}}, origin={{origin}}, "
+                         "extent={{extent}})",
+                         output_ref=im, ax=im.axes,
+                         origin=im.origin,
+                         extent=im.get_extent(),
+                         out_name_hint='im'),
+              Expression("{{im}}.set_data( {{data}} )", im=im, data=data)]
+    result.extend(_set_properties(im, image_properties))
+    decomp.ingest(data, name_hint='data')
+    return result
+
+def mpl_quadmesh_fac(decomp, mesh):
+    decomp.add_import('from matplotlib.collections import QuadMesh')
+
+    coords = mesh._coordinates
+    template = ("{{ax}}.add_collection(QuadMesh({{width}}, {{height}}, "
+                "{{coords}}, antialiased={{aa}}, shading={{shading}}))")
+    result = [Expression(template, output_ref=mesh, ax=mesh.axes,
+                         width=mesh._meshWidth, height=mesh._meshHeight,
+                         coords=coords, aa=mesh._antialiased,
+                         shading=mesh._shading,
+                         out_name_hint='mesh')]
+    result.extend(_set_array(mesh))
+    result.extend(_set_properties(mesh, mesh_properties))
+    decomp.ingest(coords, name_hint='coords')
+    return result
+
+def mpl_poly_fac(decomp, poly):
+    decomp.add_import('from matplotlib.collections import PolyCollection')
+
+    # closed polygons carry a trailing CLOSEPOLY vertex, which
+    # PolyCollection re-adds itself. Slicing it off is a view, not a copy
+    paths = poly.get_paths()
+    closed = all(p.codes is not None and p.codes[-1] == Path.CLOSEPOLY
+                 for p in paths)
+    if closed:
+        verts = [p.vertices[:-1] for p in paths]
+    else:
+        verts = [p.vertices for p in paths]
+
+    template = ("{{ax}}.add_collection(PolyCollection({{verts}}, "
+                "closed={{closed}}))")
+    result = [Expression(template, output_ref=poly, ax=poly.axes,
+                         verts=verts, closed=closed,
+                         out_name_hint='poly')]
+    result.extend(_set_array(poly))
+    result.extend(_set_properties(poly, poly_properties))
+    decomp.ingest(verts, name_hint='verts')
+    return result
@@ -0,0 +1,577 @@
+""" Optimization passes that rewrite the expressions held by an
+ExpressionManager after ingestion, and before rendering """
+from ast import literal_eval
+from collections import defaultdict
+import re
+
+from expression import (Expression, LiteralExpression, PropertyExpression,
+                        TAG_RE)
+from properties import property_state, relative_properties
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+LEAD_RE = re.compile('^\{\{\s*?(?P<tag>[a-zA-Z]\w*)\s*?\}\}')
+
+# templates (from mpl_factories) that create an object with empty child
+# lists, that append their output to a child list of another object,
+# or that assign a child list
+NEW_RE = re.compile(r'^(plt\.figure\(\)|\{\{\w+\}\}\.add_subplot\()')
+NEW_CHILDREN = ('axes', 'lines', 'images', 'collections')
+APPEND_RE = re.compile(r'^\{\{(?P<owner>\w+)\}\}\.(?P<method>plot|scatter|'
+                       r'add_collection|add_subplot)\(')
+APPEND_TO = {'plot': 'lines', 'scatter': 'collections',
+             'add_collection': 'collections', 'add_subplot': 'axes'}
+ADD_AXES_RE = re.compile(r'^\{\{(?P<owner>\w+)\}\}\.add_axes\( '
+                         r'\{\{(?P<value>\w+)\}\} \)$')
+ASSIGN_RE = re.compile(r'^\{\{(?P<owner>\w+)\}\}\.(?P<attr>\w+) = '
+                       r'\{\{(?P<value>\w+)\}\}$')
+
+
+class Style(dict):
+    """A dict of property values shared by several objects.
+
+    A distinct type, so that each style gets its own identity (and
+    variable name) in the manager
+    """
+
+
+def _prune(mgr, candidates):
+    """Remove expressions that define one of the candidate objects, if
+    no remaining expression depends on that object.
+
+    :rtype: int. The number of expressions removed
+    """
+    num = 0
+    candidates = dict((id(c), c) for c in candidates)
+    while candidates:
+        used = set(id(d) for e in mgr.expressions for d in e.dependencies)
+        dead = [e for e in mgr.expressions
+                if hasattr(e, 'output_ref') and
+                id(e.output_ref) in candidates and
+                id(e.output_ref) not in used]
+        candidates = {}
+        num += len(dead)
+        for e in dead:
+            mgr.remove(e)
+            for d in e.dependencies:
+                candidates[id(d)] = d
+    return num
+
+
+def factor_styles(mgr, min_objects=2, min_properties=2):
+    """Replace property setters shared by many objects with shared styles
+
+    Property values that at least *min_objects* objects set to the same
+    thing are collected into one Style per distinct combination, and
+    each object applies its style with a single update() call. Values
+    are compared by their rendered definition. Setters whose order
+    matters, like set_xlim and set_autoscalex_on, are left in place.
+
+    :param mgr: The ExpressionManager to rewrite
+    :param min_objects: Minimum number of objects that must share a
+    style before it is factored out
+    :param min_properties: Minimum number of properties in a style
+
+    :rtype: int. The number of styles created
+    """
+    setters = defaultdict(list)
+    for e in mgr.expressions:
+        if isinstance(e, PropertyExpression):
+            setters[id(e.artist)].append(e)
+    #update() applies a style in no particular order
+    setters = dict((oid, _reorderable(exps))
+                   for oid, exps in setters.items())
+
+    keys = {}
+    counts = defaultdict(int)
+    for exps in setters.values():
+        for e in exps:
+            keys[e] = (e.prop, mgr.definition(e.value))
+            counts[keys[e]] += 1
+
+    #objects with the same set of widely shared values share a style
+    groups = defaultdict(list)
+    for oid, exps in setters.items():
+        shared = [e for e in exps if counts[keys[e]] >= min_objects]
+        style = frozenset(keys[e] for e in shared)
+        if len(style) >= min_properties:
+            groups[style].append(shared)
+
+    num = 0
+    stale = []
+    for style, members in sorted(groups.items(), key=lambda x: sorted(x[0])):
+        if len(members) < min_objects:
+            continue
+
+        #take values from the first member; the rest become redundant
+        first = sorted(members[0], key=lambda e: e.prop)
+        values = Style((e.prop, e.value) for e in first)
+        template = 'dict(%s)' % ', '.join('%s={{%s}}' % (e.prop, e.prop)
+                                          for e in first)
+        refs = dict((e.prop, e.value) for e in first)
+        mgr.append(Expression(template, output_ref=values,
+                              out_name_hint='style', **refs))
+
+        for shared in members:
+            for e in shared:
+                mgr.remove(e)
+                stale.append(e.value)
+            mgr.append(Expression("{{artist}}.update( {{style}} )",
+                                  artist=shared[0].artist, style=values))
+        num += 1
+
+    _prune(mgr, stale)
+    return num
+
+
+def _coupled_properties():
+    """Properties whose setters write state that other properties write
+    differently, like xlim and autoscalex_on"""
+    props = set(property_state)
+    for cells in property_state.values():
+        props.update(cells)
+    state = dict((p, property_state.get(p, (p,))) for p in props)
+    return frozenset(p for p in props
+                     if any(state[p] != state[q] and
+                            set(state[p]) & set(state[q]) for q in props))
+
+_coupled = _coupled_properties()
+
+
+def _reorderable(setters):
+    """The setters of one object that give the same result in any order
+    relative to the others"""
+    writers = defaultdict(int)
+    for e in setters:
+        for cell in _state(e):
+            writers[cell] += 1
+    return [e for e in setters if e.prop not in _coupled and
+            all(writers[cell] == 1 for cell in _state(e))]
+
+
+class LoopVariable(object):
+    """Stands in for a variable that is assigned by a for loop"""
+
+
+def _blocks(mgr):
+    """Group the expressions that define and modify an object.
+
+    A block is an expression that defines an object, plus the statements
+    whose template starts with a reference to that object, like
+    "{{artist}}.set_color( {{val}} )". Returns a dict mapping the
+    defining expressions to a list of statements, for blocks with at
+    least one statement
+    """
+    heads = dict((id(e.output_ref), e) for e in mgr.expressions
+                 if hasattr(e, 'output_ref') and e.template and
+                 not e.inlined and not isinstance(e, LiteralExpression))
+    result = defaultdict(list)
+    for e in mgr.expressions:
+        if hasattr(e, 'output_ref') or not e.template:
+            continue
+        m = LEAD_RE.match(e.template)
+        if m is None or m.group('tag') not in e.refs:
+            continue
+        head = heads.get(id(e.refs[m.group('tag')]))
+        if head is not None:
+            result[head].append(e)
+    return result
+
+
+def _signature(head, statements):
+    """Blocks with equal signatures can be folded into one loop"""
+    templates = sorted(s.template for s in statements)
+    return (head.template, tuple(templates))
+
+
+def _depends_on(mgr, objs, targets):
+    """Whether any object in objs is, or depends on, an object in targets"""
+    seen = set()
+    stack = list(objs)
+    while stack:
+        obj = stack.pop()
+        if id(obj) in targets:
+            return True
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        definer = mgr.definer(obj)
+        if definer is not None:
+            stack.extend(definer.dependencies)
+    return False
+
+
+def _same(mgr, values):
+    """Whether a list of objects can be replaced by its first item"""
+    first = values[0]
+    if all(v is first for v in values):
+        return True
+    definers = [mgr.definer(v) for v in values]
+    if any(d is None for d in definers):
+        return False
+    if all(d.inlined for d in definers):
+        text = mgr.reference(first)
+        return all(mgr.reference(v) == text for v in values)
+    if _stackable(mgr, values):
+        return all(np.array_equal(v, first) for v in values)
+    return False
+
+
+def _stackable(mgr, values):
+    """Whether a list of arrays can be stacked into one array"""
+    if np is None or any(type(v) is not np.ndarray for v in values):
+        return False
+    if not all(isinstance(mgr.definer(v), LiteralExpression)
+               for v in values):
+        return False
+    first = values[0]
+    return all(v.shape == first.shape and v.dtype == first.dtype and
+               not v.dtype.hasobject for v in values)
+
+
+def _table(mgr, values, hint):
+    """Register an object holding one value per loop iteration"""
+    if _stackable(mgr, values):
+        table = np.array(values)
+        encoder = mgr.definer(values[0]).encoder
+        mgr.append(LiteralExpression(table, encoder=encoder, inlined=False,
+                                     out_name_hint=hint))
+        return table
+
+    table = list(values)
+    template = '[%s]' % ', '.join('{{v_%3.3i}}' % i
+                                  for i in range(len(values)))
+    refs = dict(('v_%3.3i' % i, v) for i, v in enumerate(values))
+    mgr.append(Expression(template, output_ref=table, out_name_hint=hint,
+                          **refs))
+    return table
+
+
+def _fold(mgr, blocks):
+    """Replace a list of structurally identical blocks with one loop"""
+    rows = []
+    for head, statements in blocks:
+        rows.append([head] + sorted(statements, key=lambda s: s.template))
+    outputs = [head.output_ref for head, _ in blocks]
+    hint = blocks[0][0].out_name_hint or 'object'
+
+    #each tag of each statement is either a constant, the block's
+    #own output, or a value that varies between blocks
+    body = []
+    refs = {}
+    columns = []
+    for j, exp in enumerate(rows[0]):
+        names = {}
+        for tag in set(TAG_RE.findall(exp.template)):
+            values = [row[j].refs[tag] for row in rows]
+            name = 's%3.3i_%s' % (j, tag)
+            names[tag] = name
+            if all(v is out for v, out in zip(values, outputs)):
+                names[tag] = 'item'
+            elif _same(mgr, values):
+                refs[name] = values[0]
+            else:
+                if isinstance(exp, PropertyExpression):
+                    col_hint = exp.prop
+                else:
+                    col_hint = tag
+                columns.append((name, col_hint, values))
+        template = TAG_RE.sub(lambda m: '{{%s}}' % names[m.group('tag')],
+                              exp.template)
+        if j == 0:
+            template = '{{item}} = %s' % template
+        body.append(template)
+
+    if _depends_on(mgr, [v for _, _, values in columns for v in values] +
+                   refs.values(), set(id(o) for o in outputs)):
+        return False
+
+    #the block definitions are replaced by the loop
+    for row in rows:
+        for exp in row:
+            mgr.remove(exp)
+
+    result = []
+    mgr.append(Expression('[]', output_ref=result,
+                          out_name_hint=hint + 's'))
+    refs['result'] = result
+
+    tables = []
+    loop_vars = []
+    for name, col_hint, values in columns:
+        table = _table(mgr, values, col_hint + 's')
+        refs['t' + name] = table
+        refs[name] = LoopVariable()
+        tables.append('{{t%s}}' % name)
+        loop_vars.append('{{%s}}' % name)
+    refs['item'] = LoopVariable()
+
+    if not columns:
+        header = 'for _ in range(%i):' % len(rows)
+    elif len(columns) == 1:
+        header = 'for %s in %s:' % (loop_vars[0], tables[0])
+    else:
+        header = 'for %s in zip(%s):' % (', '.join(loop_vars),
+                                         ', '.join(tables))
+    body.append('{{result}}.append({{item}})')
+    template = '\n    '.join([header] + body)
+    loop = Expression(template, **refs)
+    mgr.append(loop)
+    _prune(mgr, [v for row in rows for exp in row
+                 for v in exp.dependencies])
+
+    mgr.alias(refs['item'], loop, label=hint)
+    for name, col_hint, _ in columns:
+        mgr.alias(refs[name], loop, label=col_hint)
+    label = mgr.label(result)
+    for i, out in enumerate(outputs):
+        mgr.alias(out, loop, label='%s[%i]' % (label, i))
+    return True
+
+
+def fold_loops(mgr, min_blocks=3):
+    """Replace repeated blocks of statements with for loops
+
+    Objects that are created and modified by identical templates, like
+    many lines added with the same plot() call and setters, are created
+    in a single loop. Values that differ between blocks are collected into
+    tables (numpy arrays of the same shape and dtype are stacked into
+    one array), and the objects are appended to a list.
+
+    :param mgr: The ExpressionManager to rewrite
+    :param min_blocks: Minimum number of identical blocks to fold
+
+    :rtype: int. The number of loops created
+    """
+    order = mgr.ordered_expressions()
+    position = dict((id(e), i) for i, e in enumerate(order))
+    appends = defaultdict(list)
+    for e in order:
+        child = _appended_child(e)
+        if child is not None:
+            appends[child].append(position[id(e)])
+
+    groups = defaultdict(list)
+    for head, statements in _blocks(mgr).items():
+        key = _signature(head, statements)
+        #blocks that repeat a template can't be matched up unambiguously
+        if len(set(key[1])) == len(key[1]):
+            groups[key].append((head, statements))
+
+    for blocks in groups.values():
+        blocks.sort(key=lambda b: position[id(b[0])])
+
+    num = 0
+    for blocks in sorted(groups.values(),
+                         key=lambda b: position[id(b[0][0])]):
+        if len(blocks) < min_blocks or \
+                _reorders_children(blocks, position, appends):
+            continue
+        if _fold(mgr, blocks):
+            num += 1
+    return num
+
+
+def _appended_child(e):
+    """The (owner id, child list) that a statement appends its output
+    to, like "{{ax}}.plot(...)" does to the lines of ax, or None"""
+    if not hasattr(e, 'output_ref') or not e.template:
+        return None
+    m = APPEND_RE.match(e.template)
+    if m is None:
+        return None
+    return id(e.refs[m.group('owner')]), APPEND_TO[m.group('method')]
+
+
+def _reorders_children(blocks, position, appends):
+    """Whether a loop would change the order of a child list
+
+    The loop runs after all the blocks it replaces, so other statements
+    can't append to the same list after the first block
+    """
+    first = position[id(blocks[0][0])]
+    own = set(position[id(head)] for head, _ in blocks)
+    for head, _ in blocks:
+        child = _appended_child(head)
+        if child is not None and any(p > first and p not in own
+                                     for p in appends[child]):
+            return True
+    return False
+
+
+def _list_items(mgr, obj):
+    """The items of a list defined by a "[{{x_000}}, ...]" template, or
+    None if obj isn't defined that way"""
+    e = mgr.definer(obj)
+    if e is None or isinstance(e, LiteralExpression) or not e.template:
+        return None
+    if not (e.template.startswith('[') and e.template.endswith(']')):
+        return None
+    return [e.refs[t] for t in TAG_RE.findall(e.template)]
+
+
+def _child_statement(e):
+    """The match for a statement that only adds to, or assigns, a list of
+    child artists, or None"""
+    if hasattr(e, 'output_ref') or not e.template:
+        return None
+    m = ADD_AXES_RE.match(e.template)
+    if m is not None:
+        return m
+    m = ASSIGN_RE.match(e.template)
+    if m is not None and m.group('attr') in NEW_CHILDREN:
+        return m
+    return None
+
+
+def _redundant_children(mgr, order):
+    """Child list statements that don't change the list they target.
+
+    Tracks the children of objects created by known templates, in
+    execution order
+    """
+    result = set()
+    children = {}
+    for e in order:
+        template = e.template or ''
+        if hasattr(e, 'output_ref'):
+            if NEW_RE.match(template):
+                for attr in NEW_CHILDREN:
+                    children[id(e.output_ref), attr] = []
+            m = APPEND_RE.match(template)
+            if m is not None:
+                key = (id(e.refs[m.group('owner')]),
+                       APPEND_TO[m.group('method')])
+                if key in children:
+                    children[key].append(id(e.output_ref))
+            continue
+
+        m = _child_statement(e)
+        if m is None:
+            #any other statement might change the children of its refs
+            if not isinstance(e, PropertyExpression):
+                for d in e.dependencies:
+                    for attr in NEW_CHILDREN:
+                        children.pop((id(d), attr), None)
+            continue
+
+        owner, value = e.refs[m.group('owner')], e.refs[m.group('value')]
+        if 'attr' not in m.groupdict():
+            key = (id(owner), 'axes')
+            if key in children and id(value) in children[key]:
+                result.add(e)
+            elif key in children:
+                children[key].append(id(value))
+            continue
+
+        key = (id(owner), m.group('attr'))
+        items = _list_items(mgr, value)
+        if items is None:
+            children.pop(key, None)
+            continue
+        items = [id(i) for i in items]
+        if children.get(key) == items:
+            result.add(e)
+        children[key] = items
+    return result
+
+
+def _state(e):
+    return property_state.get(e.prop, (e.prop,))
+
+
+def _implied(e, text, written):
+    """Whether a setter writes what earlier setters already wrote
+
+    :param text: The code for the value that e sets
+    :param written: dict mapping state to the (prop, text) of the
+    setter that last wrote it
+    """
+    cells = _state(e)
+    if e.prop in relative_properties:
+        #same bounds as the current limits, in either orientation
+        cell = relative_properties[e.prop]
+        last = written.get(cell)
+        if last == (e.prop, text):
+            return True
+        if last is None or last[0] != cell:
+            return False
+        try:
+            return tuple(sorted(literal_eval(last[1]))) == \
+                tuple(literal_eval(text))
+        except (ValueError, SyntaxError, TypeError):
+            return False
+
+    return all(c in written and written[c][1] == text and
+               written[c][0] not in relative_properties for c in cells)
+
+
+def _barrier(e, state):
+    """Forget what is known about the objects that a statement other
+    than a setter uses"""
+    if isinstance(e, PropertyExpression):
+        state.pop(id(e.value), None)
+    elif _child_statement(e) is None:
+        for d in e.dependencies:
+            state.pop(id(d), None)
+
+
+def eliminate_dead_statements(mgr):
+    """Remove statements whose effect is overwritten or already implied
+
+    Setters are dead if a later setter on the same object writes the same
+    state, or if an earlier setter already wrote the same value (like
+    set_xbound after set_xlim with the same limits). Any other statement
+    that uses the object in between keeps both. Statements that assign or
+    add child artists (like "ax.lines = [...]") are dead if the factory
+    calls that created those children already attached them.
+
+    Definitions that only dead statements used are removed as well. Run
+    this before factor_styles and fold_loops, which hide setters and
+    child list definitions from it.
+
+    :param mgr: The ExpressionManager to rewrite
+
+    :rtype: int. The number of expressions removed
+    """
+    order = mgr.ordered_expressions()
+    dead = _redundant_children(mgr, order)
+
+    written = defaultdict(dict)
+    for e in order:
+        if e in dead:
+            continue
+        if not isinstance(e, PropertyExpression):
+            _barrier(e, written)
+            continue
+        text = mgr.reference(e.value)
+        state = written[id(e.artist)]
+        if _implied(e, text, state):
+            dead.add(e)
+            continue
+        for cell in _state(e):
+            state[cell] = (e.prop, text)
+        _barrier(e, written)
+
+    overwritten = defaultdict(set)
+    for e in reversed(order):
+        if e in dead:
+            continue
+        if not isinstance(e, PropertyExpression):
+            _barrier(e, overwritten)
+            continue
+        state = overwritten[id(e.artist)]
+        if state.issuperset(_state(e)):
+            dead.add(e)
+            continue
+        state.update(_state(e))
+        if e.prop in relative_properties:
+            state.discard(relative_properties[e.prop])
+        _barrier(e, overwritten)
+
+    for e in dead:
+        mgr.remove(e)
+    return len(dead) + _prune(mgr, [d for e in dead for d in e.dependencies])
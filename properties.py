@@ -82,3 +82,57 @@ figure_properties = (
 rect_properties = (
     'alpha', 'ec', 'fc', 'fill', 'hatch', 'ls', 'lw', 'visible',
     'zorder')
+
+image_properties = (
+    'alpha',
+    'clim',
+    'cmap',
+    'filternorm',
+    'filterrad',
+    'gid',
+    'interpolation',
+    'label',
+    'resample',
+    'url',
+    'visible',
+    'zorder',
+    )
+
+mesh_properties = (
+    'alpha',
+    'clim',
+    'cmap',
+    'edgecolor',
+    'facecolor',
+    'gid',
+    'label',
+    'linestyle',
+    'linewidth',
+    'urls',
+    'visible',
+    'zorder',
+    )
+
+poly_properties = mesh_properties
+
+# state written by a setter, for setters that don't just write the
+# property of the same name
+property_state = {
+    'aa': ('antialiased',),
+    'autoscale_on': ('autoscalex_on', 'autoscaley_on'),
+    'ec': ('edgecolor',),
+    'fc': ('facecolor',),
+    'ls': ('linestyle',),
+    'lw': ('linewidth',),
+    'xbound': ('xlim', 'autoscalex_on'),
+    'xlim': ('xlim', 'autoscalex_on'),
+    'ybound': ('ylim', 'autoscaley_on'),
+    'ylim': ('ylim', 'autoscaley_on'),
+    }
+
+# setters whose effect depends on the state they overwrite: bounds keep
+# the orientation of the current limits
+relative_properties = {
+    'xbound': 'xlim',
+    'ybound': 'ylim',
+    }
@@ -0,0 +1,200 @@
+""" Save the expression graph of an ExpressionManager to disk, and load
+it back without the objects it was built from
+
+A snapshot file holds a magic string, the length of a pickled header,
+the header itself, and the raw buffers of every numpy array defined by
+a LiteralExpression. Buffers are aligned, so that load() can memory map
+them instead of reading them in.
+
+Objects that are defined by templated expressions are not stored. When
+loaded, they are replaced by Placeholder objects, which are only used
+as keys by the ExpressionManager.
+"""
+import cPickle as pickle
+import struct
+
+from expression import (Expression, ExpressionManager, LiteralExpression,
+                        PropertyExpression, ReferenceExpression)
+
+MAGIC = 'MPLDSNAP\x02'
+ALIGN = 64
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class Placeholder(object):
+    """Stands in for an object that a snapshot doesn't store"""
+    __slots__ = ('index',)
+
+    def __init__(self, index):
+        self.index = index
+
+    def __repr__(self):
+        return '<Placeholder %i>' % self.index
+
+
+class _Nodes(object):
+    """Assign integer ids to the objects referenced by expressions"""
+    def __init__(self):
+        self._ids = {}
+        self._objs = []
+
+    def __call__(self, obj):
+        oid = id(obj)
+        if oid not in self._ids:
+            self._ids[oid] = len(self._objs)
+            self._objs.append(obj)
+        return self._ids[oid]
+
+    def __len__(self):
+        return len(self._objs)
+
+
+def _is_raw_array(x):
+    return (np is not None and type(x) is np.ndarray and
+            not x.dtype.hasobject)
+
+
+def _pad(offset):
+    return (ALIGN - offset % ALIGN) % ALIGN
+
+
+def save(mgr, path, imports=()):
+    """Write the expressions held by an ExpressionManager to a file
+
+    :param mgr: The ExpressionManager to save
+    :param path: The file name to write to
+    :param imports: Optional list of import statements to save alongside
+    """
+    nodes = _Nodes()
+    arrays = []
+    records = []
+    labels = {}
+    for e in mgr.expressions:
+        out = None
+        if hasattr(e, 'output_ref'):
+            out = nodes(e.output_ref)
+            labels[out] = mgr.label(e.output_ref)
+        if isinstance(e, LiteralExpression):
+            if _is_raw_array(e.output_ref):
+                value = None
+                arrays.append(e.output_ref)
+                payload = len(arrays) - 1
+            else:
+                value = e.output_ref
+                payload = None
+            records.append(('literal', out, e.inlined, e.out_name_hint,
+                            (value, payload, e.encoder)))
+        elif isinstance(e, ReferenceExpression):
+            records.append(('reference', out, e.inlined, e.out_name_hint,
+                            None))
+        elif isinstance(e, PropertyExpression):
+            records.append(('property', out, e.inlined, e.out_name_hint,
+                            (e.prop, nodes(e.artist), nodes(e.value))))
+        else:
+            refs = dict((k, nodes(v)) for k, v in e.refs.items())
+            records.append(('expression', out, e.inlined, e.out_name_hint,
+                            (e.template, refs)))
+
+    index = dict((id(e), i) for i, e in enumerate(mgr.expressions))
+    aliases = [(nodes(obj), index[id(e)], mgr.label(obj))
+               for obj, e in mgr.aliases()]
+
+    # array buffers follow the header, each aligned to ALIGN bytes.
+    # Offsets are relative to the end of the header
+    layout = []
+    offset = 0
+    for a in arrays:
+        fortran = a.flags.f_contiguous and not a.flags.c_contiguous
+        offset += _pad(offset)
+        layout.append((a.dtype.str, a.shape, fortran, offset))
+        offset += a.nbytes
+
+    header = pickle.dumps((len(nodes), records, labels, aliases, layout,
+                           list(imports)), protocol=2)
+    start = len(MAGIC) + 8 + len(header)
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        f.write('\0' * _pad(start))
+        written = 0
+        for a, (_, _, fortran, offset) in zip(arrays, layout):
+            f.write('\0' * (offset - written))
+            # the transpose of a fortran ordered array is C ordered
+            a = a.T if fortran else a
+            f.write(np.ascontiguousarray(a).data)
+            written = offset + a.nbytes
+
+
+def _read_array(path, base, dtype, shape, fortran, offset, mmap):
+    dtype = np.dtype(dtype)
+    count = int(np.prod(shape))
+    order = 'F' if fortran else 'C'
+    if count == 0:
+        return np.empty(shape, dtype=dtype, order=order)
+    if mmap:
+        result = np.memmap(path, dtype=dtype, mode='r', offset=base + offset,
+                           shape=shape, order=order)
+        return result.view(np.ndarray)
+    with open(path, 'rb') as f:
+        f.seek(base + offset)
+        result = np.fromfile(f, dtype=dtype, count=count)
+    return result.reshape(shape, order=order)
+
+
+def load(path, mmap=True):
+    """Load a snapshot written by save()
+
+    :param path: The file name to read
+    :param mmap: If True (the default), memory map array payloads
+    instead of reading them
+
+    :rtype: tuple of (ExpressionManager, list of import statements)
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise IOError("%s is not a decompiler snapshot" % path)
+        size, = struct.unpack('<Q', f.read(8))
+        header = pickle.loads(f.read(size))
+    num_nodes, records, labels, aliases, layout, imports = header
+    base = len(MAGIC) + 8 + size
+    base += _pad(base)
+
+    objs = [Placeholder(i) for i in range(num_nodes)]
+    for kind, out, inlined, hint, data in records:
+        if kind != 'literal':
+            continue
+        value, payload, encoder = data
+        if payload is not None:
+            value = _read_array(path, base, *layout[payload], mmap=mmap)
+        objs[out] = value
+
+    mgr = ExpressionManager()
+    exps = []
+    for kind, out, inlined, hint, data in records:
+        if kind == 'literal':
+            e = LiteralExpression(objs[out], encoder=data[2],
+                                  inlined=inlined, out_name_hint=hint)
+        elif kind == 'reference':
+            e = ReferenceExpression(objs[out], out_name_hint=hint)
+        elif kind == 'property':
+            prop, artist, value = data
+            e = PropertyExpression(objs[artist], prop, objs[value])
+        else:
+            template, refs = data
+            refs = dict((k, objs[v]) for k, v in refs.items())
+            if out is not None:
+                refs['output_ref'] = objs[out]
+            e = Expression(template, inlined=inlined, out_name_hint=hint,
+                           **refs)
+        mgr.append(e, label=labels.get(out))
+        exps.append(e)
+
+    for node, exp, label in aliases:
+        mgr.alias(objs[node], exps[exp], label=label)
+
+    return mgr, imports
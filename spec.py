@@ -0,0 +1,267 @@
+""" Write the expressions held by an ExpressionManager as a figure spec,
+and rebuild the objects from it without generating a script
+
+A spec is an uncompressed .npz file. Its "spec" entry holds JSON
+metadata, and the other entries hold the numpy arrays defined by
+LiteralExpressions. The metadata lists statements in execution order:
+
+ * ["value", node, x]: x is a JSON literal
+ * ["eval", node, source]: source is evaluated after the imports
+ * ["array", node, [key, offset, shape, order]]: a view of the array
+   stored under key. Arrays are packed into one buffer per dtype, so
+   they can be read in bulk
+ * ["call", node, template, [nodes]]: apply a template to other nodes.
+   node is null for statements that don't define an object
+ * ["set", node, [[prop, node], ...]]: a run of setters on one object
+ * ["reference", node, name]: an object passed to load() by name
+
+Each distinct template is compiled into a function once, and setters are
+applied without rendering anything, so loading skips most of the work
+of parsing and executing the equivalent script.
+"""
+import gc
+import json
+import re
+import threading
+
+import numpy as np
+
+from expression import (LiteralExpression, PropertyExpression,
+                        ReferenceExpression, TAG_RE)
+
+VERSION = 1
+IDENTIFIER_RE = re.compile(r'^[a-zA-Z_]\w*$')
+
+
+class _PauseGC(object):
+    """Disables garbage collection while any thread is inside the context"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._count = 0
+        self._enabled = False
+
+    def __enter__(self):
+        with self._lock:
+            if self._count == 0:
+                self._enabled = gc.isenabled()
+                gc.disable()
+            self._count += 1
+
+    def __exit__(self, *exc_info):
+        with self._lock:
+            self._count -= 1
+            if self._count == 0 and self._enabled:
+                gc.enable()
+
+_pause_gc = _PauseGC()
+
+
+class _Nodes(object):
+    """Assign integer ids to the objects referenced by expressions"""
+    def __init__(self):
+        self._ids = {}
+
+    def __call__(self, obj):
+        oid = id(obj)
+        if oid not in self._ids:
+            self._ids[oid] = len(self._ids)
+        return self._ids[oid]
+
+    def __len__(self):
+        return len(self._ids)
+
+
+def _json_value(x):
+    """Whether a value survives a round trip through JSON as itself"""
+    if x is None or type(x) in (bool, int, float):
+        return True
+    if type(x) is str:
+        try:
+            x.decode('utf-8')
+        except UnicodeDecodeError:
+            return False
+        return True
+    return False
+
+
+class _Buffers(object):
+    """Pack arrays into one flat buffer per dtype"""
+    def __init__(self):
+        self._parts = {}
+        self._sizes = {}
+
+    def __call__(self, x):
+        key = x.dtype.str
+        order = 'F' if x.flags.f_contiguous and not x.flags.c_contiguous \
+            else 'C'
+        offset = self._sizes.get(key, 0)
+        self._parts.setdefault(key, []).append(x.ravel(order=order))
+        self._sizes[key] = offset + x.size
+        return [key, offset, list(x.shape), order]
+
+    def arrays(self):
+        return dict((k, np.concatenate(v)) for k, v in self._parts.items())
+
+
+def _literal(e, out, buffers, oracle):
+    x = e.output_ref
+    if e.encoder is repr and _json_value(x):
+        return ['value', out, x]
+    if type(x) is np.ndarray and not x.dtype.hasobject:
+        return ['array', out, buffers(x)]
+    return ['eval', out, e.render(oracle)]
+
+
+def save(mgr, path, imports=()):
+    """Write the expressions held by an ExpressionManager to a spec file
+
+    :param mgr: The ExpressionManager to save
+    :param path: The file name to write to. np.savez adds a .npz
+    extension if it's missing
+    :param imports: Optional list of import statements the expressions
+    need
+    """
+    nodes = _Nodes()
+    buffers = _Buffers()
+    templates = {}
+    statements = []
+    labels = {}
+    index = {}
+
+    for e in mgr.ordered_expressions():
+        out = None
+        if hasattr(e, 'output_ref'):
+            out = nodes(e.output_ref)
+            if not e.inlined:
+                labels[out] = mgr.label(e.output_ref)
+
+        if isinstance(e, LiteralExpression):
+            statements.append(_literal(e, out, buffers, mgr))
+        elif isinstance(e, ReferenceExpression):
+            statements.append(['reference', out, mgr.label(e.output_ref)])
+        elif isinstance(e, PropertyExpression):
+            artist = nodes(e.artist)
+            last = statements[-1] if statements else None
+            if last is None or last[0] != 'set' or last[1] != artist:
+                statements.append(['set', artist, []])
+            statements[-1][2].append([e.prop, nodes(e.value)])
+        else:
+            template = templates.setdefault(e.template, len(templates))
+            args = [nodes(e.refs[t]) for t in _params(e.template)]
+            statements.append(['call', out, template, args])
+        index[id(e)] = len(statements) - 1
+
+    #an alias is resolved after the statement that defines it, by
+    #evaluating its variable name
+    aliases = [(nodes(obj), index[id(e)], mgr.label(obj))
+               for obj, e in mgr.aliases()]
+
+    header = dict(version=VERSION, nodes=len(nodes), imports=list(imports),
+                  templates=sorted(templates, key=templates.get),
+                  statements=statements, labels=labels, aliases=aliases)
+    spec = np.frombuffer(json.dumps(header), dtype=np.uint8)
+    np.savez(path, spec=spec, **buffers.arrays())
+
+
+def _params(template):
+    """Distinct tags of a template, in a fixed order"""
+    return sorted(set(TAG_RE.findall(template)))
+
+
+def _compile(template, defines, namespace):
+    """A function that executes a template, given its references as
+    arguments in _params order"""
+    params = _params(template)
+    body = TAG_RE.sub(lambda m: '_' + m.group('tag'), template)
+    body = body.replace('\n', '\n    ')
+    if defines:
+        body = 'return (%s)' % body
+    source = 'def f(%s):\n    %s\n' % (', '.join('_' + p for p in params),
+                                       body)
+    local = {}
+    exec compile(source, '<spec>', 'exec') in namespace, local
+    return local['f']
+
+
+def load(path, references=None):
+    """Rebuild the objects described by a spec file written by save()
+
+    :param path: The file name to read
+    :param references: Optional dict mapping variable names to the
+    objects that the spec refers to without defining them (see
+    Decompiler.references)
+
+    :rtype: dict mapping variable names to objects, like the namespace
+    of the equivalent script
+    """
+    #everything built while loading is kept, so garbage collection
+    #passes triggered by the many new objects are wasted
+    with _pause_gc:
+        with np.load(path) as data:
+            return _load(path, data, references or {})
+
+
+def _load(path, data, references):
+    header = {}
+    if 'spec' in data.files:
+        header = json.loads(data['spec'].tostring())
+    if header.get('version') != VERSION:
+        raise IOError("%s is not a version %i figure spec" %
+                      (path, VERSION))
+
+    namespace = {}
+    for stmt in header['imports']:
+        exec stmt in namespace
+
+    labels = dict((int(k), str(v)) for k, v in header['labels'].items())
+    aliases = {}
+    for node, stmt, label in header['aliases']:
+        aliases.setdefault(stmt, []).append((node, label))
+
+    buffers = dict((k, data[k]) for k in data.files if k != 'spec')
+    funcs = {}
+    templates = header['templates']
+    vals = [None] * header['nodes']
+    names = dict(namespace)
+    for i, s in enumerate(header['statements']):
+        kind, node = s[0], s[1]
+        if kind == 'set':
+            artist = vals[node]
+            for prop, value in s[2]:
+                getattr(artist, 'set_' + prop)(vals[value])
+        elif kind == 'call':
+            key = s[2], node is not None
+            if key not in funcs:
+                funcs[key] = _compile(templates[s[2]], key[1], namespace)
+            result = funcs[key](*[vals[a] for a in s[3]])
+            if node is not None:
+                vals[node] = result
+        elif kind == 'value':
+            value = s[2]
+            vals[node] = value.encode('utf-8') \
+                if isinstance(value, unicode) else value
+        elif kind == 'reference':
+            if s[2] not in references:
+                raise NameError("%s refers to %s, which is not in references"
+                                % (path, s[2]))
+            vals[node] = references[s[2]]
+        elif kind == 'array':
+            key, offset, shape, order = s[2]
+            size = int(np.prod(shape))
+            vals[node] = buffers[key][offset:offset + size].reshape(
+                shape, order=order)
+        else:
+            vals[node] = eval(s[2], namespace)
+
+        if node is not None and node in labels and kind != 'set':
+            names[labels[node]] = vals[node]
+        for alias, label in aliases.get(i, ()):
+            #loop variables only exist inside their loop
+            try:
+                vals[alias] = eval(label, names)
+            except NameError:
+                continue
+            if IDENTIFIER_RE.match(label):
+                names[label] = vals[alias]
+
+    return dict((labels[n], vals[n]) for n in labels)
@@ -105,3 +105,202 @@ def test_magic_method():
     result = d.render()
 
     assert result == answer
+
+def test_masked_array_decompile():
+    """Masked arrays keep dtype, memory layout and mask"""
+    import numpy as np
+    x = np.ma.masked_array(np.asfortranarray(np.ones((3, 4), np.float32)))
+    x[1, 2] = np.ma.masked
+    d = Decompiler()
+    d.ingest(x)
+
+    ref = d.mgr.reference(x)
+    exec(d.render())
+    y = locals()[ref]
+    assert y.dtype == np.float32
+    assert y.flags.f_contiguous
+    np.testing.assert_array_equal(y.mask, x.mask)
+    np.testing.assert_array_equal(y, x)
+
+def test_masked_array_names():
+    import numpy as np
+    x = np.ma.masked_array(np.arange(3.), mask=[0, 1, 0])
+    d = Decompiler()
+    d.ingest(x, name_hint='z')
+
+    assert d.render().splitlines()[-1] == \
+        "z = np.ma.masked_array(data, mask=mask)"
+
+def test_image_mesh_poly_decompile():
+    import numpy as np
+    import matplotlib.pyplot as plt
+    fig = plt.figure()
+    ax = fig.add_subplot(121)
+    ax.imshow(np.arange(12.).reshape(3, 4), cmap='gray')
+    ax2 = fig.add_subplot(122)
+    ax2.pcolormesh(np.arange(6.).reshape(2, 3))
+    ax2.fill_between([1, 2, 3], [1, 2, 3], [2, 3, 5])
+    d = Decompiler()
+    d.ingest(fig, name_hint='fig')
+
+    ns = {}
+    exec(d.render(), ns)
+    axes = sorted(ns['fig'].axes, key=lambda a: a.get_geometry())
+    im, = axes[0].images
+    mesh, poly = axes[1].collections
+    np.testing.assert_array_equal(im.get_array(), ax.images[0].get_array())
+    assert im.get_cmap().name == 'gray'
+    np.testing.assert_array_equal(mesh.get_array(),
+                                  ax2.collections[0].get_array())
+    np.testing.assert_array_equal(poly.get_paths()[0].vertices,
+                                  ax2.collections[1].get_paths()[0].vertices)
+    plt.close(fig)
+
+@pytest.mark.parametrize('dtype', ['int64', 'int32', 'int16', 'uint8'])
+def test_integer_image_mesh_decompile(dtype):
+    """Integer data gives numpy integer color limits"""
+    import numpy as np
+    import matplotlib.pyplot as plt
+    fig = plt.figure()
+    ax = fig.add_subplot(121)
+    ax.imshow(np.arange(12, dtype=dtype).reshape(3, 4))
+    ax2 = fig.add_subplot(122)
+    ax2.pcolormesh(np.arange(6, dtype=dtype).reshape(2, 3))
+    d = Decompiler()
+    d.ingest(fig, name_hint='fig')
+
+    ns = {}
+    exec(d.render(), ns)
+    axes = sorted(ns['fig'].axes, key=lambda a: a.get_geometry())
+    im, = axes[0].images
+    mesh, = axes[1].collections
+    np.testing.assert_array_equal(im.get_array(), ax.images[0].get_array())
+    assert im.get_clim() == ax.images[0].get_clim()
+    np.testing.assert_array_equal(mesh.get_array(),
+                                  ax2.collections[0].get_array())
+    assert mesh.get_clim() == ax2.collections[0].get_clim()
+    plt.close(fig)
+
+def test_numpy_scalars_render_as_python_numbers():
+    import numpy as np
+    values = [np.int8(-3), np.uint16(7), np.int64(2 ** 40), np.float32(0.1),
+              np.float64(2.5), np.complex64(1 + 2j), np.bool_(True)]
+    d = Decompiler()
+    d.ingest(values)
+
+    ns = {}
+    exec(d.render(), ns)
+    assert ns[d.mgr.reference(values)] == [v.item() for v in values]
+
+def test_registry_is_immutable():
+    with pytest.raises(TypeError):
+        Decompiler.expression_factory[int] = None
+
+def test_register_copy_on_write():
+    class Point(object):
+        pass
+
+    class PointDecompiler(Decompiler):
+        pass
+
+    before = PointDecompiler()
+    PointDecompiler.register(
+        Point, lambda d, p: [Expression('Point()', output_ref=p)])
+    p = Point()
+    d = PointDecompiler()
+    d.ingest(p)
+    assert d.render().endswith('= Point()')
+
+    #running decompilers and base classes keep their factories
+    for d in (before, Decompiler()):
+        with pytest.raises(TypeError):
+            d.ingest(p)
+
+def test_concurrent_decompiles():
+    """Many threads decompile shared figures, with shared caches"""
+    import threading
+    from matplotlib.figure import Figure
+
+    figs = []
+    for i in range(4):
+        fig = Figure()
+        ax = fig.add_subplot(111)
+        for j in range(i + 1):
+            ax.plot([1, 2, 3], [j, i, j], color='rgb'[j % 3])
+        figs.append(fig)
+
+    def decompile(fig):
+        d = Decompiler()
+        d.ingest(fig, name_hint='fig')
+        return d.render()
+
+    expected = [decompile(f) for f in figs]
+    errors = []
+
+    def work(offset):
+        try:
+            for i in range(20):
+                k = (i + offset) % len(figs)
+                assert decompile(figs[k]) == expected[k]
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+
+def test_render_to_file(tmpdir):
+    d = Decompiler()
+    d.ingest([1, 2, 3, 4, 5, 6], name_hint='x')
+    path = tmpdir.join('script.py')
+
+    src = d.render(str(path))
+    assert path.read() == src
+    assert not tmpdir.join('script.pyc').check()
+    with pytest.raises(ValueError):
+        d.render(precompile=True)
+
+def _run(path):
+    import runpy
+    return runpy.run_path(str(path))
+
+def test_render_precompiled(tmpdir):
+    import os
+    import marshal
+    import bytecode
+    d = Decompiler()
+    d.ingest([1, 2, 3, 4, 5, 6], name_hint='x')
+    path = tmpdir.join('script.py')
+    d.render(str(path), precompile=True)
+    compiled, stub = map(tmpdir.join, ('script.pyc', 'script_run.py'))
+    assert (str(compiled), str(stub)) == bytecode.paths(str(path))
+
+    assert _run(stub)['x'] == [1, 2, 3, 4, 5, 6]
+
+    #the stub runs the compiled code, as long as it is current
+    data = compiled.read('rb')
+    code = compile('x = "compiled"', str(path), 'exec')
+    compiled.write(data[:8] + marshal.dumps(code), 'wb')
+    assert _run(stub)['x'] == 'compiled'
+
+    #and falls back to the source otherwise
+    compiled.write('\0\0\0\0' + data[4:], 'wb')
+    assert _run(stub)['x'] == [1, 2, 3, 4, 5, 6]
+    compiled.write(data[:8] + marshal.dumps(code), 'wb')
+    mtime = os.stat(str(path)).st_mtime
+    os.utime(str(path), (mtime + 10, mtime + 10))
+    assert _run(stub)['x'] == [1, 2, 3, 4, 5, 6]
+    compiled.remove()
+    assert _run(stub)['x'] == [1, 2, 3, 4, 5, 6]
+
+def test_render_precompiled_needs_path():
+    """Bad arguments are rejected before any rendering work"""
+    d = Decompiler()
+    d.ingest([1, 2, 3, 4, 5, 6], name_hint='x')
+    d._render = None
+    with pytest.raises(ValueError):
+        d.render(precompile=True)
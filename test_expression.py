@@ -115,6 +115,15 @@ def test_expmgr_assigns_unique_references():
     em = ExpressionManager([e1, e2])
     assert em.reference(x) != em.reference(y)
 
+def test_expmgr_avoids_keywords():
+    x = [1,2,3]
+    y = [2,3,4]
+    em = ExpressionManager()
+    em.append(Expression("[1, 2, 3]", output_ref=x, out_name_hint='as'))
+    em.append(Expression("[2, 3, 4]", output_ref=y), label='print')
+    assert em.reference(x) == 'as_'
+    assert em.reference(y) == 'print_'
+
 def test_conflicting_definitions():
     em = ExpressionManager()
     x=5
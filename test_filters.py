@@ -0,0 +1,162 @@
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.image import AxesImage
+
+from decompiler import Decompiler
+from filters import of_type, labeled, on_axes, selects
+import spec
+
+import pytest
+
+def _dashboard():
+    fig = plt.figure()
+    for i in range(4):
+        ax = fig.add_subplot(2, 2, i + 1)
+        ax.plot([1, 2, 3], [i, i, i], label='data %i' % i)
+        ax.plot([1, 2, 3], [3, 2, 1], label='_fit %i' % i)
+    fig.axes[3].imshow(np.arange(12.).reshape(3, 4))
+    return fig
+
+def _replay(d, **refs):
+    ns = dict(refs)
+    exec(d.render(), ns)
+    return ns
+
+def test_predicates():
+    fig = _dashboard()
+    ax = fig.axes[0]
+    line = ax.lines[1]
+
+    assert of_type(AxesImage)(fig.axes[3].images[0])
+    assert not of_type(AxesImage)(line)
+    assert labeled('_*')(line)
+    assert not labeled('data*', 'x')(line)
+    assert on_axes(ax)(ax) and on_axes(ax)(line)
+    assert not on_axes(ax)(fig.axes[1].lines[0])
+    assert not labeled('_*')(fig)
+    assert selects(labeled('_*'), fig)
+    plt.close(fig)
+
+def test_include_axes():
+    fig = _dashboard()
+    ax = fig.axes[2]
+    d = Decompiler(include=on_axes(ax))
+    assert d.ingest(fig, name_hint='fig')
+
+    src = d.render()
+    assert src.count('add_subplot') == 1
+    assert src.count('.plot(') == 2
+    for other in fig.axes[:2]:
+        assert d.mgr.definer(other.lines[0]) is None
+
+    result, = _replay(d)['fig'].axes
+    assert result.get_geometry() == (2, 2, 3)
+    assert sorted(l.get_label() for l in result.lines) == \
+        ['_fit 2', 'data 2']
+    plt.close('all')
+
+def test_include_keeps_containers():
+    fig = _dashboard()
+    d = Decompiler(include=labeled('data*'))
+    d.ingest(fig, name_hint='fig')
+
+    result = _replay(d)['fig']
+    assert len(result.axes) == 4
+    for ax in result.axes:
+        assert [l.get_label() for l in ax.lines] == \
+            ['data %i' % (ax.get_geometry()[2] - 1)]
+        assert ax.images == []
+    plt.close('all')
+
+def test_exclude():
+    fig = _dashboard()
+    d = Decompiler(exclude=lambda a: labeled('_*')(a) or
+                   of_type(AxesImage)(a))
+    d.ingest(fig, name_hint='fig')
+
+    src = d.render()
+    assert '_fit' not in src
+    assert 'AxesImage' not in src
+    assert src.count('.plot(') == 4
+    plt.close('all')
+
+def test_max_depth():
+    fig = _dashboard()
+    d = Decompiler(max_depth=1)
+    d.ingest(fig, name_hint='fig')
+
+    src = d.render()
+    assert src.count('add_subplot') == 4
+    assert '.plot(' not in src
+    result = _replay(d)['fig']
+    assert [ax.lines for ax in result.axes] == [[]] * 4
+
+    d = Decompiler(max_depth=0)
+    d.ingest(fig, name_hint='fig')
+    assert 'add_subplot' not in d.render()
+    plt.close('all')
+
+def test_reference_only(tmpdir):
+    fig = _dashboard()
+    ax = fig.axes[0]
+    fit = ax.lines[1]
+    d = Decompiler(exclude=labeled('_*'), reference_only=True)
+    assert d.ingest(ax, name_hint='ax')
+    assert d.ingest(fit)
+
+    #the axes needs its figure, which adds the other axes
+    refs = d.references()
+    assert sorted(l.get_label() for l in refs.values()) == \
+        ['_fit %i' % i for i in range(4)]
+    defined = [l.split(' = ')[0] for l in d.render().splitlines()]
+    assert not set(refs) & set(defined)
+
+    name = d.mgr.label(ax)
+    assert _replay(d, **refs)[name].lines[1] is fit
+    path = str(tmpdir.join('fig.npz'))
+    d.save_spec(path)
+    assert spec.load(path, refs)[name].lines[1] is fit
+    with pytest.raises(NameError):
+        spec.load(path)
+    plt.close('all')
+
+def test_filtered_out_objects_are_left_out():
+    """Statements that need filtered out objects are not rendered"""
+    fig = _dashboard()
+    ax = fig.axes[0]
+    d = Decompiler(exclude=labeled('_*'))
+    d.ingest(ax, name_hint='ax')
+    assert not d.ingest(ax.lines[1])
+
+    assert '.lines = ' not in d.render()
+    assert d.references() == {}
+    plt.close('all')
+
+@pytest.mark.parametrize('options', [dict(max_depth=0),
+                                     dict(exclude=of_type(Figure))])
+def test_left_out_container(options):
+    """An axes is left out when its figure is, along with the lines
+    ingested as if the axes were available"""
+    fig = _dashboard()
+    ax = fig.axes[0]
+    d = Decompiler(**options)
+    assert not d.ingest(ax, name_hint='ax')
+    assert not d.ingest(ax.lines[0])
+
+    assert d.mgr.expressions == []
+    assert d.render() in ('', 'import numpy as np')
+    plt.close('all')
+
+def test_left_out_container_referenced():
+    fig = _dashboard()
+    ax = fig.axes[0]
+    d = Decompiler(exclude=of_type(Figure), reference_only=True)
+    assert d.ingest(ax, name_hint='ax')
+
+    refs = d.references()
+    assert refs.values() == [fig]
+    result = _replay(d, **refs)['ax']
+    assert result.figure is fig
+    assert [l.get_label() for l in result.lines] == ['data 0', '_fit 0']
+    plt.close('all')
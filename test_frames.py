@@ -0,0 +1,81 @@
+import numpy as np
+import matplotlib.pyplot as plt
+
+from frames import FrameDecompiler
+
+import pytest
+
+def _figure(y, color='b'):
+    fig = plt.figure()
+    ax = fig.add_subplot(111)
+    ax.plot([1, 2, 3], y, color=color)
+    ax.plot([1, 2, 3], [3, 2, 1], color='k')
+    return fig
+
+def _replay(d):
+    ns = {}
+    exec(d.render(), ns)
+    return ns
+
+def test_only_changes_emitted():
+    figs = [_figure([1, 2, 3]), _figure([1, 2, 3]),
+            _figure([1, 2, 4]), _figure([1, 2, 4], color='r')]
+    d = FrameDecompiler()
+    d.ingest_frames(figs)
+    src = d.render()
+
+    frames = [l for l in src.splitlines() if l.startswith('frame')]
+    assert 'frames = [frame, [], frame_02, frame_03]' in frames
+    assert len([f for f in frames if 'set_ydata' in f]) == 2
+    assert len([f for f in frames if 'set_xdata' in f]) == 0
+    for f in figs:
+        plt.close(f)
+
+def test_replay_frames():
+    fig = _figure([1, 2, 3])
+    line = fig.axes[0].lines[0]
+    d = FrameDecompiler()
+    d.add_frame(fig)
+    line.set_ydata([4, 5, 6])
+    d.add_frame(fig)
+    line.set_color('r')
+    d.add_frame(fig)
+
+    ns = _replay(d)
+    p, = [l for l in ns['fig'].axes[0].lines if l.get_color() != 'k']
+    ns['update'](1)
+    np.testing.assert_array_equal(p.get_ydata(), [4, 5, 6])
+    assert p.get_color() == 'b'
+    ns['update'](2)
+    assert p.get_color() == 'r'
+    ns['update'](0)
+    np.testing.assert_array_equal(p.get_ydata(), [1, 2, 3])
+    assert p.get_color() == 'b'
+    plt.close(fig)
+
+def test_single_frame_is_plain_script():
+    fig = _figure([1, 2, 3])
+    d = FrameDecompiler()
+    d.add_frame(fig)
+    assert 'FuncAnimation' not in d.render()
+    plt.close(fig)
+
+def test_mismatched_frames():
+    fig = _figure([1, 2, 3])
+    d = FrameDecompiler()
+    d.add_frame(fig)
+    fig.axes[0].plot([1, 2], [1, 2])
+    with pytest.raises(ValueError) as exc:
+        d.add_frame(fig)
+    assert exc.value.args[0] == ("Frame 1 does not have the same artists "
+                                 "as the first frame")
+    plt.close(fig)
+
+def test_no_frames_after_render():
+    fig = _figure([1, 2, 3])
+    d = FrameDecompiler()
+    d.add_frame(fig)
+    d.render()
+    with pytest.raises(RuntimeError):
+        d.add_frame(fig)
+    plt.close(fig)
@@ -0,0 +1,299 @@
+from expression import Expression, PropertyExpression
+from decompiler import Decompiler
+from optimize import factor_styles, fold_loops, eliminate_dead_statements
+
+import pytest
+
+class Styled(object):
+    """Minimal artist-like object with setters and update()"""
+    def __init__(self, **props):
+        self.props = props
+
+    def __expfac__(self, decompiler, obj):
+        result = [Expression("Styled()", output_ref=obj, out_name_hint='s')]
+        for k, v in sorted(obj.props.items()):
+            result.append(PropertyExpression(obj, k, v))
+        return result
+
+    def update(self, props):
+        self.props.update(props)
+
+    def __getattr__(self, attr):
+        if not attr.startswith('set_'):
+            raise AttributeError(attr)
+        return lambda v: self.props.__setitem__(attr[4:], v)
+
+class Sequenced(Styled):
+    """Styled object that replays a list of setter calls. A None
+    property stands for a call that reads the current properties"""
+    def __init__(self, calls):
+        super(Sequenced, self).__init__()
+        self.calls = calls
+        for k, v in calls:
+            if k is not None:
+                self.props[k] = v
+
+    def __expfac__(self, decompiler, obj):
+        result = [Expression("Styled()", output_ref=obj, out_name_hint='s')]
+        for k, v in obj.calls:
+            if k is None:
+                result.append(Expression("{{s}}.update( {} )", s=obj))
+            else:
+                result.append(PropertyExpression(obj, k, v))
+        return result
+
+def _replay(d, objs):
+    ns = {'Styled': Styled}
+    exec(d.render(), ns)
+    return [eval(d.mgr.reference(o), ns).props for o in objs]
+
+def _decompile(objs):
+    d = Decompiler()
+    for o in objs:
+        d.ingest(o)
+    return d
+
+def test_factor_shared_styles():
+    objs = [Styled(color='r', lw=2, label='a%i' % i) for i in range(5)]
+    objs += [Styled(color='b', lw=2, label='b%i' % i) for i in range(5)]
+    d = _decompile(objs)
+
+    assert factor_styles(d.mgr) == 2
+    src = d.render()
+    assert src.count('.update(') == 10
+    assert src.count('.set_color(') == 0
+    assert src.count('.set_label(') == 10
+    assert _replay(d, objs) == [o.props for o in objs]
+
+def test_factor_styles_threshold():
+    """Styles used by fewer than min_objects objects are left alone"""
+    objs = [Styled(color='r', lw=2), Styled(color='r', lw=2)]
+    d = _decompile(objs)
+
+    assert factor_styles(d.mgr, min_objects=3) == 0
+    assert d.render().count('.set_') == 4
+
+def test_factor_styles_prunes_stale_values():
+    """Values only used by removed setters are not defined anymore"""
+    objs = [Styled(dashes=[1, 2, 3, 4, 5, 6], lw=1) for i in range(3)]
+    d = _decompile(objs)
+
+    factor_styles(d.mgr)
+    src = d.render()
+    assert src.count('[1, 2, 3, 4, 5, 6]') == 1
+    assert _replay(d, objs) == [o.props for o in objs]
+
+def test_factor_styles_figure():
+    import numpy as np
+    import matplotlib.pyplot as plt
+    fig = plt.figure()
+    ax = fig.add_subplot(111)
+    for i in range(10):
+        ax.plot(np.arange(3), np.arange(3) * i, color='rb'[i % 2])
+    d = Decompiler()
+    d.ingest(fig, name_hint='fig')
+
+    factor_styles(d.mgr)
+    ns = {}
+    exec(d.render(), ns)
+    lines = ns['fig'].axes[0].lines
+    assert sorted(l.get_color() for l in lines) == ['b'] * 5 + ['r'] * 5
+    plt.close(fig)
+
+def _axes_state(fig):
+    return [(ax.get_autoscalex_on(), ax.get_autoscaley_on(),
+             ax.get_xlim(), ax.get_ylim(), ax.get_axis_bgcolor())
+            for ax in sorted(fig.axes, key=lambda a: a.get_geometry())]
+
+@pytest.mark.parametrize('fold', [False, True])
+def test_factor_styles_keeps_axes_state(fold):
+    """Setters that must run in order stay out of styles"""
+    import matplotlib.pyplot as plt
+    fig = plt.figure()
+    for i in range(4):
+        ax = fig.add_subplot(2, 2, i + 1)
+        ax.plot([1, 2, 3], [3, 1, 2])
+
+    def replay(optimize):
+        d = Decompiler()
+        d.ingest(fig, name_hint='fig')
+        if optimize:
+            assert factor_styles(d.mgr) > 0
+            if fold:
+                fold_loops(d.mgr)
+        ns = {}
+        exec(d.render(), ns)
+        return _axes_state(ns['fig'])
+
+    expected = replay(False)
+    assert expected[0][:2] == (False, False)
+    assert replay(True) == expected
+    plt.close(fig)
+
+def test_fold_loops():
+    objs = [Styled(color='rgb'[i % 3], lw=2, label='s%i' % i)
+            for i in range(6)]
+    d = _decompile(objs)
+
+    assert fold_loops(d.mgr) == 1
+    src = d.render()
+    assert src.count('for ') == 1
+    assert src.count('.set_color(') == 1
+    assert "colors = ['r', 'g', 'b', 'r', 'g', 'b']" in src
+    assert d.mgr.reference(objs[2]) == 'ss[2]'
+    assert _replay(d, objs) == [o.props for o in objs]
+
+def test_fold_loops_threshold():
+    objs = [Styled(color='r'), Styled(color='b')]
+    d = _decompile(objs)
+
+    assert fold_loops(d.mgr) == 0
+    assert fold_loops(d.mgr, min_blocks=2) == 1
+
+def test_fold_loops_stacks_arrays():
+    import numpy as np
+    objs = [Styled(data=np.arange(4, dtype=np.int8) * i) for i in range(3)]
+    d = _decompile(objs)
+
+    fold_loops(d.mgr)
+    table, = [e.output_ref for e in d.mgr.expressions
+              if isinstance(getattr(e, 'output_ref', None), np.ndarray)]
+    assert table.shape == (3, 4)
+    assert table.dtype == np.int8
+    for o, p in zip(objs, _replay(d, objs)):
+        np.testing.assert_array_equal(o.props['data'], p['data'])
+
+def test_fold_loops_skips_cycles():
+    """Blocks that refer to each other are not folded"""
+    objs = [Styled()]
+    for i in range(3):
+        objs.append(Styled(prev=objs[-1]))
+    d = _decompile(objs[1:])
+
+    assert fold_loops(d.mgr) == 0
+    assert _replay(d, objs)
+
+def test_fold_loops_figure():
+    import numpy as np
+    import matplotlib.pyplot as plt
+    fig = plt.figure()
+    ax = fig.add_subplot(111)
+    for i in range(10):
+        ax.plot(np.arange(3), np.arange(3) * i, color='rb'[i % 2])
+    d = Decompiler()
+    d.ingest(fig, name_hint='fig')
+
+    factor_styles(d.mgr)
+    assert fold_loops(d.mgr) == 1
+    ns = {}
+    exec(d.render(), ns)
+    lines = ns['fig'].axes[0].lines
+    assert [l.get_color() for l in lines] == ['r', 'b'] * 5
+    np.testing.assert_array_equal(lines[3].get_ydata(), [0, 3, 6])
+    plt.close(fig)
+
+def _mesh_figure(polys=False):
+    import numpy as np
+    import matplotlib.pyplot as plt
+    fig = plt.figure()
+    for i in range(3):
+        ax = fig.add_subplot(1, 3, i + 1)
+        ax.pcolormesh(np.arange(6.).reshape(2, 3) * i)
+        if polys:
+            ax.fill_between([1, 2, 3], [1, 2, 3], [2, 3, 5 + i])
+    return fig
+
+def _collections(fig):
+    return [[type(c).__name__ for c in ax.collections]
+            for ax in sorted(fig.axes, key=lambda a: a.get_geometry())]
+
+def test_fold_loops_meshes():
+    """Tables are not named after keywords, like the color arrays of
+    meshes, which set_array() refers to as {{a}}"""
+    import numpy as np
+    import matplotlib.pyplot as plt
+    fig = _mesh_figure()
+    d = Decompiler()
+    d.ingest(fig, name_hint='fig')
+
+    assert fold_loops(d.mgr) > 0
+    src = d.render()
+    assert 'as_ = ' in src
+    ns = {}
+    exec(src, ns)
+    axes = sorted(ns['fig'].axes, key=lambda a: a.get_geometry())
+    for ax, orig in zip(axes, fig.axes):
+        np.testing.assert_array_equal(ax.collections[0].get_array(),
+                                      orig.collections[0].get_array())
+    plt.close('all')
+
+def test_fold_loops_keeps_child_order():
+    """Loops don't move appends to a child list past other appends"""
+    import matplotlib.pyplot as plt
+    fig = _mesh_figure(polys=True)
+    d = Decompiler()
+    d.ingest(fig, name_hint='fig')
+
+    eliminate_dead_statements(d.mgr)
+    factor_styles(d.mgr)
+    fold_loops(d.mgr)
+    ns = {}
+    exec(d.render(), ns)
+    assert _collections(ns['fig']) == _collections(fig) == \
+        [['QuadMesh', 'PolyCollection']] * 3
+    plt.close('all')
+
+def test_eliminate_overwritten_setters():
+    obj = Sequenced([('color', 'r'), ('lw', 1), ('color', 'b'),
+                     ('lw', 1), ('dashes', [1, 2])])
+    d = _decompile([obj])
+
+    #two setters, and the definition of 'r'
+    assert eliminate_dead_statements(d.mgr) == 3
+    src = d.render()
+    assert src.count('.set_color(') == 1
+    assert src.count('.set_lw(') == 1
+    assert _replay(d, [obj]) == [obj.props]
+
+def test_eliminate_prunes_values():
+    obj = Sequenced([('dashes', [1, 2, 3]), ('dashes', [4, 5])])
+    d = _decompile([obj])
+
+    #one setter, the list and its items
+    assert eliminate_dead_statements(d.mgr) == 5
+    assert '[1, 2, 3]' not in d.render()
+    assert _replay(d, [obj]) == [obj.props]
+
+def test_eliminate_stops_at_other_statements():
+    """Setters are kept if another statement uses the object in between"""
+    obj = Sequenced([('color', 'r'), (None, None), ('color', 'r'),
+                     ('color', 'b')])
+    d = _decompile([obj])
+
+    assert eliminate_dead_statements(d.mgr) == 1
+    assert d.render().count('.set_color(') == 2
+
+def test_eliminate_axes_statements():
+    import matplotlib.pyplot as plt
+    fig = plt.figure()
+    ax = fig.add_subplot(111)
+    ax.plot([1, 2, 3], [3, 1, 2])
+    ax.set_xlim(3, 0)
+    d = Decompiler()
+    d.ingest(fig, name_hint='fig')
+
+    assert eliminate_dead_statements(d.mgr) > 0
+    src = d.render()
+    assert '.set_xbound(' not in src
+    assert '.set_ybound(' not in src
+    assert '.add_axes(' not in src
+    assert '.lines = ' not in src
+    assert '.set_xlim( (3.0, 0.0) )' in src
+
+    ns = {}
+    exec(src, ns)
+    ax2, = ns['fig'].axes
+    assert ax2.get_xlim() == (3, 0)
+    assert ax2.get_ylim() == ax.get_ylim()
+    assert len(ax2.lines) == 1
+    plt.close(fig)
@@ -0,0 +1,110 @@
+from expression import Expression
+from decompiler import Decompiler
+from optimize import factor_styles, fold_loops
+import snapshot
+
+import pytest
+
+def _lines(d):
+    return sorted(d.render().splitlines())
+
+def test_roundtrip(tmpdir):
+    x = {'a': [1, 2, 3, 4, 5, 6], 'b': (1.5, None, u'u'), 'c': '{{x}}'}
+    d = Decompiler()
+    d.ingest(x, name_hint='x')
+    path = str(tmpdir.join('snap'))
+    d.save(path)
+
+    d2 = Decompiler.load(path)
+    assert _lines(d2) == _lines(d)
+    ns = {}
+    exec(d2.render(), ns)
+    assert ns['x'] == x
+
+def test_labels_survive_removal(tmpdir):
+    """Saved variable names are reused, even if they are not what the
+    manager would pick today"""
+    d = Decompiler()
+    x, y = [1] * 10, [2] * 10
+    d.ingest(x)
+    d.ingest(y)
+    d.mgr.remove([e for e in d.mgr.expressions if e.output_ref is x][0])
+    path = str(tmpdir.join('snap'))
+    d.save(path)
+
+    assert Decompiler.load(path).render() == d.render()
+
+@pytest.mark.parametrize('mmap', [True, False])
+def test_array_payloads(tmpdir, mmap):
+    import numpy as np
+    x = np.asfortranarray(np.arange(12, dtype=np.int16).reshape(3, 4))
+    y = np.zeros((0, 3))
+    d = Decompiler()
+    d.ingest([x, y, np.float32(3)], name_hint='l')
+    path = str(tmpdir.join('snap'))
+    d.save(path)
+
+    d2 = Decompiler.load(path, mmap=mmap)
+    assert _lines(d2) == _lines(d)
+    x2, y2 = [e.output_ref for e in d2.mgr.expressions
+              if isinstance(e.output_ref, np.ndarray)]
+    np.testing.assert_array_equal(x2, x)
+    assert x2.dtype == x.dtype
+    assert x2.flags.f_contiguous
+    assert y2.shape == y.shape
+    assert isinstance(x2.base, np.memmap) == mmap
+
+def test_placeholders(tmpdir):
+    """Objects without a literal definition are replaced by placeholders"""
+    class Foo(object):
+        pass
+    f = Foo()
+    d = Decompiler()
+    d.mgr.extend([Expression("Foo()", output_ref=f, out_name_hint='foo'),
+                  Expression("{{foo}}.bar = 3", foo=f)])
+    path = str(tmpdir.join('snap'))
+    d.save(path)
+
+    d2 = Decompiler.load(path)
+    assert _lines(d2) == ['foo = Foo()', 'foo.bar = 3']
+    assert isinstance(d2.mgr.expressions[0].output_ref, snapshot.Placeholder)
+
+def test_figure_roundtrip(tmpdir):
+    import numpy as np
+    import matplotlib.pyplot as plt
+    fig = plt.figure()
+    ax = fig.add_subplot(111)
+    ax.imshow(np.arange(12.).reshape(3, 4))
+    for i in range(3):
+        ax.plot([1, 2, 3], [i, i, i])
+    d = Decompiler()
+    d.ingest(fig)
+    factor_styles(d.mgr)
+    fold_loops(d.mgr)
+    path = str(tmpdir.join('snap'))
+    d.save(path)
+    plt.close(fig)
+
+    d2 = Decompiler.load(path)
+    assert _lines(d2) == _lines(d)
+    exec(d2.render(), {})
+
+def test_not_a_snapshot(tmpdir):
+    path = tmpdir.join('snap')
+    path.write('print 5')
+    with pytest.raises(IOError) as exc:
+        snapshot.load(str(path))
+    assert exc.value.args[0].endswith("is not a decompiler snapshot")
+
+def test_references(tmpdir):
+    from expression import ReferenceExpression
+    outside = object()
+    d = Decompiler()
+    d.mgr.extend([ReferenceExpression(outside, out_name_hint='outside'),
+                  Expression("{{x}}.bar = 3", x=outside)])
+    path = str(tmpdir.join('snap'))
+    d.save(path)
+
+    d2 = Decompiler.load(path)
+    assert d2.render() == d.render() == 'outside.bar = 3'
+    assert d2.references().keys() == ['outside']
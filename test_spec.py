@@ -0,0 +1,114 @@
+import numpy as np
+import matplotlib.pyplot as plt
+
+from expression import Expression
+from decompiler import Decompiler
+from frames import FrameDecompiler
+from optimize import eliminate_dead_statements, factor_styles, fold_loops
+import spec
+
+import pytest
+
+def _roundtrip(d, tmpdir):
+    path = str(tmpdir.join('fig.npz'))
+    d.save_spec(path)
+    return spec.load(path)
+
+def test_literals(tmpdir):
+    x = {'a': [1, 2, 3, 4, 5, 6], 'b': (1.5, None, u'u\xe9', 'abc'),
+         'c': '{{x}}', 'd': [1j, True, 10 ** 30, float('inf')]}
+    d = Decompiler()
+    d.ingest(x, name_hint='x')
+
+    x2 = _roundtrip(d, tmpdir)['x']
+    assert x2 == x
+    assert type(x2['c']) is str
+    assert type(x2['b'][2]) is unicode
+
+def test_arrays(tmpdir):
+    x = np.asfortranarray(np.arange(12, dtype=np.int16).reshape(3, 4))
+    y = np.zeros((0, 3))
+    z = np.ma.masked_array(np.arange(3.), mask=[0, 1, 0])
+    d = Decompiler()
+    d.ingest([x, y, z, np.arange(5, dtype=np.int16), np.float32(3), 'a'],
+             name_hint='l')
+
+    x2, y2, z2, w2, f2, _ = _roundtrip(d, tmpdir)['l']
+    np.testing.assert_array_equal(x2, x)
+    assert x2.dtype == x.dtype
+    assert x2.flags.f_contiguous
+    assert y2.shape == y.shape
+    np.testing.assert_array_equal(z2.mask, z.mask)
+    np.testing.assert_array_equal(w2, np.arange(5))
+    assert f2 == 3
+
+def test_statements(tmpdir):
+    """Templates that don't define anything, or span several lines"""
+    d = Decompiler()
+    x = []
+    d.mgr.extend([Expression('[]', output_ref=x, out_name_hint='x'),
+                  Expression('for i in range(3):\n    {{x}}.append(i)',
+                             x=x)])
+
+    assert _roundtrip(d, tmpdir)['x'] == [0, 1, 2]
+
+def _figure():
+    fig = plt.figure()
+    ax = fig.add_subplot(121)
+    for i in range(5):
+        ax.plot([1, 2, 3], [i, 2 * i, i], color='rb'[i % 2], lw=i)
+    ax.set_xlim(3, 0)
+    ax = fig.add_subplot(122)
+    ax.imshow(np.arange(12.).reshape(3, 4))
+    return fig
+
+def _axes(fig):
+    return sorted(fig.axes, key=lambda ax: ax.get_position().bounds)
+
+@pytest.mark.parametrize('optimize', [False, True])
+def test_figure(tmpdir, optimize):
+    fig = _figure()
+    d = Decompiler()
+    d.ingest(fig, name_hint='fig')
+    if optimize:
+        eliminate_dead_statements(d.mgr)
+        factor_styles(d.mgr)
+        fold_loops(d.mgr)
+    ns = _roundtrip(d, tmpdir)
+    script = {}
+    exec(d.render(), script)
+
+    assert set(ns) <= set(script)
+    for result in (ns['fig'], script['fig']):
+        lines, image = _axes(result)
+        assert lines.get_xlim() == (3, 0)
+        assert [l.get_color() for l in lines.lines] == \
+            [l.get_color() for l in fig.axes[0].lines]
+        np.testing.assert_array_equal(lines.lines[3].get_ydata(), [3, 6, 3])
+        np.testing.assert_array_equal(image.images[0].get_array(),
+                                      fig.axes[1].images[0].get_array())
+    plt.close('all')
+
+def test_animation(tmpdir):
+    figs = []
+    for i in range(3):
+        fig = plt.figure()
+        fig.add_subplot(111).plot([1, 2, 3], [i, i, i])
+        figs.append(fig)
+    d = FrameDecompiler()
+    d.ingest_frames(figs)
+
+    ns = _roundtrip(d, tmpdir)
+    line, = ns['fig'].axes[0].lines
+    ns['update'](2)
+    np.testing.assert_array_equal(line.get_ydata(), [2, 2, 2])
+    ns['update'](0)
+    np.testing.assert_array_equal(line.get_ydata(), [0, 0, 0])
+    plt.close('all')
+
+def test_not_a_spec(tmpdir):
+    path = str(tmpdir.join('other.npz'))
+    np.savez(path, x=np.arange(3))
+    with pytest.raises(IOError) as exc:
+        spec.load(path)
+    assert exc.value.args[0].endswith("is not a version 1 figure spec")
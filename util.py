@@ -1,8 +1,10 @@
-def toposort(data):
+def toposort(data, key=None):
     """Topologically sort a graph
 
     :param data: A dictionary of sets, where the keys are vertices,
     and the values are the dependencies of each vertex
+    :param key: Optional sort key, to order vertices whose dependencies
+    are satisfied at the same time
 
     :rtype: List
 
@@ -25,7 +27,7 @@ def toposort(data):
         v.discard(k)
 
     #add any missing nodes with no dependencies
-    extra_deps = reduce(set.union, data.values()) - set(data.keys())
+    extra_deps = set().union(*data.values()) - set(data.keys())
     data.update({item:set() for item in extra_deps})
 
     result = []
@@ -34,7 +36,7 @@ def toposort(data):
         ordered = set(item for item, dep in data.items() if not dep)
         if not ordered:
             break
-        result.extend(sorted(ordered))
+        result.extend(sorted(ordered, key=key))
 
         # mark dependencies as satisfied
         data = {item : (dep - ordered) for item, dep in data.items()